@@ -0,0 +1,401 @@
+import sys
+import os
+import time
+import getopt
+import json
+import platform
+import random
+import resource
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+from common.GitDataCollector import GitDataCollector
+from common.constans import conf
+from common import tracing
+
+os.environ["LC_ALL"] = "C"
+
+# shape of the generated repository
+shape = {
+    "commits": 2000,  # commits, including merges
+    "authors": 20,
+    "files": 300,  # files in the tree once it has grown
+    "lines": 40,  # average number of lines of a text file
+    "binary": 0.05,  # fraction of added files that are binary
+    "tags": 20,
+    "branches": 0,  # concurrent side branches, 0 for a linear history
+    "merges": 0.1,  # chance that a commit on main merges a side branch
+    "skew": 0.0,  # chance that a commit's author date is up to a month old
+    "seed": 1,
+}
+
+# phases measure() times, in the order gitstats runs them
+PHASES = ("cache_load", "collect", "cache_save", "refine", "json")
+
+# phases GitDataCollector.collect() runs concurrently; only their wall time
+# is reported, from the spans they record (see common.tracing)
+COLLECT_PHASES = ("tags", "history", "files", "ownership")
+
+
+def usage():
+    print("""
+Usage: benchmark [options] <outputfile>
+
+Generates a synthetic git repository, collects it with a cold and a warm
+gitstats.cache and writes wall time, CPU time, peak RSS and git processes
+started of every collection phase to <outputfile> as JSON.
+
+Options:
+-s key=value     Override repository shape value
+-c key=value     Override gitstats configuration value
+-r count         Number of cold/warm repetitions (default 1)
+-b baseline      Print the wall time of every phase relative to an earlier
+                 result file
+-k               Keep the generated repository
+
+Default shape values:
+%s
+""" % shape)
+
+
+##
+# Contents of version `version` of the file at `path`. Every version changes
+# a fifth of the lines of a text file.
+def getfilecontents(path, version):
+    r = random.Random("%s %d" % (path, version))
+    if path.endswith(".bin"):
+        return r.randbytes(r.randint(1000, 20000))
+    count = max(1, random.Random(path).randint(1, 2 * shape["lines"]) +
+                r.randint(-2, 2))
+    return "".join(
+        "%s line %d%s\n" % (path, i, " v%d" % version if
+                            (i + version) % 5 == 0 else "")
+        for i in range(count)).encode()
+
+
+class RepositoryGenerator:
+    """Writes a reproducible history as a `git fast-import` stream."""
+    def __init__(self, out):
+        self.out = out
+        self.r = random.Random(shape["seed"])
+        self.marks = 0
+        self.stamp = 1420070400  # 2015-01-01
+        self.authors = [("Author %d" % i, "author%d@domain%d.example" %
+                         (i, i % 7), "%+03d00" % self.r.randint(-11, 12))
+                        for i in range(max(1, shape["authors"]))]
+        self.main = {"ref": "refs/heads/main", "files": {}, "mark": None}
+        self.sides = []
+        self.branches = 0
+        self.mainline = []  # marks of the commits on main
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.out.write(data)
+
+    def writedata(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.write("data %d\n" % len(data))
+        self.write(data)
+        self.write("\n")
+
+    def commit(self, branch, changes, deletes=(), merge=None):
+        self.marks += 1
+        self.stamp += self.r.randint(60, 2 * 86400)
+        (name, mail, tz) = self.r.choice(self.authors)
+        stamp = self.stamp
+        if shape["skew"] > 0 and self.r.random() < shape["skew"]:
+            # e.g. rebased or cherry-picked
+            stamp -= self.r.randint(0, 30 * 86400)
+        self.write("commit %s\nmark :%d\n" % (branch["ref"], self.marks))
+        self.write("author %s <%s> %d %s\n" % (name, mail, stamp, tz))
+        self.write("committer %s <%s> %d %s\n" % (name, mail, self.stamp, tz))
+        self.writedata("commit %d" % self.marks)
+        if branch["mark"] is not None:
+            self.write("from :%d\n" % branch["mark"])
+        if merge is not None:
+            self.write("merge :%d\n" % merge["mark"])
+        for path in deletes:
+            self.write("D %s\n" % path)
+        for path in changes:
+            self.write("M 100644 inline %s\n" % path)
+            self.writedata(getfilecontents(path, branch["files"][path]))
+        self.write("\n")
+        branch["mark"] = self.marks
+        if branch is self.main:
+            self.mainline.append(self.marks)
+
+    def change(self, branch):
+        files = branch["files"]
+        changes = []
+        deletes = []
+        for _ in range(self.r.randint(1, 5)):
+            op = self.r.random()
+            if len(files) < shape["files"] and (op < 0.5 or len(files) == 0):
+                ext = ".bin" if self.r.random() < shape["binary"] else \
+                    self.r.choice([".py", ".c", ".md", ".txt", ""])
+                path = "%s/f%d%s" % (self.r.choice(["src", "src/lib", "docs",
+                                                    "test", "."]),
+                                     self.marks * 10 + len(changes), ext)
+                path = path.lstrip("./")
+                files[path] = 0
+                changes.append(path)
+            elif (op < 0.1 and branch is self.main and len(files) > 1
+                  and len(files) >= shape["files"] * 0.9):
+                path = self.r.choice(sorted(files))
+                if path not in changes:
+                    del files[path]
+                    deletes.append(path)
+            elif len(files) > 0:
+                path = self.r.choice(sorted(files))
+                files[path] += 1
+                if path not in changes:
+                    changes.append(path)
+        if "changed" in branch:
+            branch["changed"].update(changes)
+        self.commit(branch, changes, deletes)
+
+    def generate(self):
+        for _ in range(shape["commits"]):
+            if (len(self.sides) < shape["branches"] and self.main["mark"]
+                    and self.r.random() < 0.1):
+                # fork a side branch from main
+                self.branches += 1
+                side = {
+                    "ref": "refs/heads/side%d" % self.branches,
+                    "files": dict(self.main["files"]),
+                    "mark": self.main["mark"],
+                    "changed": set(),
+                }
+                self.sides.append(side)
+            if len(self.sides) > 0 and self.r.random() < 0.5:
+                self.change(self.r.choice(self.sides))
+            elif len(self.sides) > 0 and self.r.random() < shape["merges"]:
+                side = self.sides.pop(self.r.randrange(len(self.sides)))
+                changes = sorted(path for path in side["changed"]
+                                 if path in side["files"])
+                for path in changes:
+                    self.main["files"][path] = side["files"][path]
+                self.commit(self.main, changes, merge=side)
+            else:
+                self.change(self.main)
+
+        # tags on the mainline, alternating lightweight and annotated
+        step = max(1, len(self.mainline) // max(1, shape["tags"]))
+        for (i, mark) in enumerate(self.mainline[step - 1::step]):
+            if i >= shape["tags"]:
+                break
+            if i % 2 == 0:
+                self.write("reset refs/tags/v%d\nfrom :%d\n\n" % (i, mark))
+            else:
+                (name, mail, tz) = self.authors[0]
+                self.write("tag v%d\nfrom :%d\n" % (i, mark))
+                self.write("tagger %s <%s> %d %s\n" %
+                           (name, mail, self.stamp, tz))
+                self.writedata("release %d" % i)
+
+
+##
+# Create the synthetic repository at `path`
+def generaterepository(path):
+    subprocess.check_call(["git", "init", "-q", path])
+    p = subprocess.Popen(["git", "fast-import", "--quiet"],
+                         stdin=subprocess.PIPE,
+                         cwd=path)
+    RepositoryGenerator(p.stdin).generate()
+    p.stdin.close()
+    if p.wait() != 0:
+        raise RuntimeError("git fast-import failed")
+    subprocess.check_call(["git", "symbolic-ref", "HEAD", "refs/heads/main"],
+                          cwd=path)
+
+
+##
+# Count every git process started, also by history shards and executor
+# workers, which inherit the PATH: a wrapper of git put first on the PATH
+# appends a byte per process to `logfile`. The wrapper is created in
+# `bindir`; its shell adds a little to the time of every git command.
+def countspawns(logfile, bindir):
+    os.makedirs(bindir, exist_ok=True)
+    wrapper = os.path.join(bindir, "git")
+    with open(wrapper, "w") as f:
+        f.write("#!/bin/sh\nprintf . >> %s\nexec %s \"$@\"\n" %
+                (shlex.quote(logfile), shlex.quote(shutil.which("git"))))
+    os.chmod(wrapper, 0o755)
+    os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+
+
+def getpeakrss():
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+##
+# Collect the repository at `gitpath` phase by phase and write the
+# measurements to `resultfile`. Runs in a fresh process for every
+# measurement so that peak RSS is not carried over.
+def measure(gitpath, cachefile, resultfile):
+    spawnlog = resultfile + ".spawns"
+    open(spawnlog, "wb").close()
+    countspawns(spawnlog, os.path.join(os.path.dirname(resultfile), "bin"))
+    data = GitDataCollector()
+    phases = {}
+
+    def phase(name, func, *args):
+        spawns = os.path.getsize(spawnlog)
+        cpu = os.times()
+        start = time.time()
+        func(*args)
+        end = time.time()
+        cpu_end = os.times()
+        phases[name] = {
+            "wall": end - start,
+            "cpu": sum(cpu_end[0:4]) - sum(cpu[0:4]),
+            "peak_rss_kb": getpeakrss(),
+            "spawns": os.path.getsize(spawnlog) - spawns,
+        }
+
+    with open(os.devnull, "wb") as devnull:
+        phase("cache_load", data.loadCache, cachefile)
+        phase("collect", data.collect, gitpath)
+        phase("cache_save", data.saveCache, cachefile)
+        phase("refine", data.refine)
+        phase("json", data.dumpJson, devnull, None, conf["json_indent"])
+    timings = tracing.gettimings()["phases"]
+    phases["collect"]["phases"] = dict((name, timings[name]["wall"])
+                                       for name in COLLECT_PHASES
+                                       if name in timings)
+    total = {
+        "wall": sum(p["wall"] for p in phases.values()),
+        "cpu": sum(p["cpu"] for p in phases.values()),
+        "peak_rss_kb": getpeakrss(),
+        "spawns": os.path.getsize(spawnlog),
+    }
+    os.remove(spawnlog)
+    with open(resultfile, "w") as f:
+        json.dump({"phases": phases, "total": total}, f)
+
+
+def runmeasure(gitpath, cachefile, confargs, tmpdir):
+    resultfile = os.path.join(tmpdir, "result.json")
+    cmd = [sys.executable, os.path.abspath(__file__), "-M"]
+    for arg in confargs:
+        cmd += ["-c", arg]
+    cmd += [gitpath, cachefile, resultfile]
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+    with open(resultfile) as f:
+        return json.load(f)
+
+
+def compare(baseline, result):
+    runs = dict(((run["name"], run["repetition"]), run)
+                for run in baseline["runs"])
+    for run in result["runs"]:
+        base = runs.get((run["name"], run["repetition"]))
+        if base is None:
+            continue
+        print("%s #%d" % (run["name"], run["repetition"]))
+        for name in PHASES + ("total", ):
+            if name != "total" and name not in base["phases"]:
+                # measured by an older version
+                continue
+            new = run["total"] if name == "total" else run["phases"][name]
+            old = base["total"] if name == "total" else base["phases"][name]
+            print("  %-12s %9.3fs -> %9.3fs  x%.2f" %
+                  (name, old["wall"], new["wall"],
+                   new["wall"] / old["wall"] if old["wall"] > 0 else 0))
+
+
+def setoption(options, v):
+    key, value = v.split("=", 1)
+    if key not in options:
+        raise KeyError('no such key "%s"' % key)
+    options[key] = type(options[key])(value)
+
+
+if __name__ == "__main__":
+    optlist, args = getopt.getopt(sys.argv[1:], "hc:s:r:b:kM", ["help"])
+    confargs = []
+    repetitions = 1
+    baseline = None
+    keep = False
+    measuring = False
+    for o, v in optlist:
+        if o == "-c":
+            setoption(conf, v)
+            confargs.append(v)
+        elif o == "-s":
+            setoption(shape, v)
+        elif o == "-r":
+            repetitions = int(v)
+        elif o == "-b":
+            baseline = v
+        elif o == "-k":
+            keep = True
+        elif o == "-M":
+            measuring = True
+        elif o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    if measuring:
+        measure(*args)
+        sys.exit(0)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(0)
+
+    outputfile = os.path.abspath(args[0])
+    tmpdir = tempfile.mkdtemp(prefix="gitstats-benchmark-")
+    gitpath = os.path.join(tmpdir, "repo")
+    print("Generating repository in %s..." % gitpath)
+    start = time.time()
+    generaterepository(gitpath)
+    generated = time.time() - start
+
+    gitstats_repo = os.path.dirname(os.path.abspath(__file__))
+    result = {
+        "gitstats": subprocess.run(["git", "rev-parse", "HEAD"],
+                                   cwd=gitstats_repo,
+                                   capture_output=True,
+                                   text=True).stdout.strip(),
+        "git": subprocess.check_output(["git", "--version"],
+                                       text=True).strip(),
+        "python": platform.python_version(),
+        "shape": shape,
+        "conf": dict((arg.split("=", 1) for arg in confargs)),
+        "repository": {
+            "commits":
+            int(
+                subprocess.check_output(
+                    ["git", "rev-list", "--count", "--all"],
+                    cwd=gitpath)),
+            "generate": generated,
+        },
+        "runs": [],
+    }
+    for repetition in range(repetitions):
+        cachefile = os.path.join(tmpdir, "gitstats.cache")
+        if os.path.exists(cachefile):
+            os.remove(cachefile)
+        for name in ("cold", "warm"):
+            print("Measuring %s run #%d..." % (name, repetition))
+            run = runmeasure(gitpath, cachefile, confargs, tmpdir)
+            run.update({"name": name, "repetition": repetition})
+            result["runs"].append(run)
+            print("[%.5f] %s" % (run["total"]["wall"], name))
+
+    with open(outputfile, "w") as f:
+        json.dump(result, f, indent=4)
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(json.load(f), result)
+    if keep:
+        print("Repository kept in %s" % gitpath)
+    else:
+        shutil.rmtree(tmpdir)
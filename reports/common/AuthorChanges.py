@@ -0,0 +1,85 @@
+from array import array
+
+
+class AuthorChanges:
+    """
+    Cumulative lines added and commits of every author after each of their
+    commits, as parallel arrays of stamp, author id (see common.AuthorTable),
+    lines added and commits. Rows are in the order they were added; when an
+    author has several rows for one stamp the last one counts, like the
+    stamp -> author -> {lines_added, commits} dictionary it replaces.
+    """
+    def __init__(self):
+        self.stamps = array("q")
+        self.authors = array("q")
+        self.lines_added = array("q")
+        self.commits = array("q")
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def add(self, stamp, author, lines_added, commits):
+        self.stamps.append(stamp)
+        self.authors.append(author)
+        self.lines_added.append(lines_added)
+        self.commits.append(commits)
+
+    ##
+    # Append the rows of `other`, which covers later commits. `authors` maps
+    # the author ids of `other` to those of this series and `offsets` gives
+    # the (lines added, commits) of each author (by id of this series)
+    # before `other`.
+    def merge(self, other, authors, offsets):
+        self.stamps.extend(other.stamps)
+        for (author, lines_added, commits) in zip(other.authors,
+                                                  other.lines_added,
+                                                  other.commits):
+            author = authors[author]
+            (lines_offset, commits_offset) = (offsets[author]
+                                              if author < len(offsets) else
+                                              (0, 0))
+            self.authors.append(author)
+            self.lines_added.append(lines_added + lines_offset)
+            self.commits.append(commits + commits_offset)
+
+    ##
+    # (stamp, author id) -> row of the last row of each stamp and author
+    def getlastrows(self):
+        return dict(((stamp, author), row) for (row, (stamp, author)) in
+                    enumerate(zip(self.stamps, self.authors)))
+
+    ##
+    # stamp -> author name -> {lines_added, commits}, names from `names`
+    def todict(self, names):
+        changes = {}
+        for ((stamp, author), row) in self.getlastrows().items():
+            if stamp not in changes:
+                changes[stamp] = {}
+            changes[stamp][names[author]] = {
+                "lines_added": self.lines_added[row],
+                "commits": self.commits[row],
+            }
+        return changes
+
+    ##
+    # Columns (stamp, author, lines_added, commits) of one row per stamp and
+    # author, sorted by stamp and name. Authors are indexes into the list
+    # "authors" of the names of the authors that occur.
+    def tosparse(self, names):
+        rows = self.getlastrows()
+        used = sorted(set(self.authors), key=names.__getitem__)
+        index = dict((author, i) for (i, author) in enumerate(used))
+        columns = {
+            "authors": [names[author] for author in used],
+            "stamp": [],
+            "author": [],
+            "lines_added": [],
+            "commits": [],
+        }
+        for ((stamp, author), row) in sorted(
+                rows.items(), key=lambda item: (item[0][0], index[item[0][1]])):
+            columns["stamp"].append(stamp)
+            columns["author"].append(index[author])
+            columns["lines_added"].append(self.lines_added[row])
+            columns["commits"].append(self.commits[row])
+        return columns
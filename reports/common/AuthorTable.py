@@ -0,0 +1,120 @@
+import datetime
+
+from array import array
+from bisect import bisect_left
+
+
+class AuthorInfo:
+    """
+    Counters of one author of an AuthorTable. Active days are kept as a
+    sorted array of day ordinals (datetime.date.toordinal()).
+    """
+    __slots__ = ("commits", "lines_added", "lines_removed",
+                 "first_commit_stamp", "last_commit_stamp", "last_active_day",
+                 "active_days")
+
+    def __init__(self):
+        self.commits = 0
+        self.lines_added = 0
+        self.lines_removed = 0
+        self.first_commit_stamp = None
+        self.last_commit_stamp = None
+        self.last_active_day = None  # day of the last commit walked
+        self.active_days = array("l")
+
+    def addstamp(self, stamp):
+        if self.first_commit_stamp is None or stamp < self.first_commit_stamp:
+            self.first_commit_stamp = stamp
+        if self.last_commit_stamp is None or stamp > self.last_commit_stamp:
+            self.last_commit_stamp = stamp
+
+    def addday(self, day):
+        self.last_active_day = day
+        i = bisect_left(self.active_days, day)
+        if i == len(self.active_days) or self.active_days[i] != day:
+            self.active_days.insert(i, day)
+
+    ##
+    # Add the days of the sorted `days`
+    def adddays(self, days):
+        if len(self.active_days) == 0:
+            self.active_days.extend(days)
+        else:
+            self.active_days = array(
+                "l", sorted(set(self.active_days).union(days)))
+
+    ##
+    # Add the counters of `other`, which covers later commits
+    def merge(self, other):
+        self.commits += other.commits
+        self.lines_added += other.lines_added
+        self.lines_removed += other.lines_removed
+        if other.first_commit_stamp is not None:
+            self.addstamp(other.first_commit_stamp)
+            self.addstamp(other.last_commit_stamp)
+        self.adddays(other.active_days)
+        if self.last_active_day is None:
+            self.last_active_day = other.last_active_day
+
+    ##
+    # The counters as the report has them, days as "YYYY-MM-DD"
+    def todict(self):
+        info = {
+            "commits": self.commits,
+            "lines_added": self.lines_added,
+            "lines_removed": self.lines_removed,
+        }
+        if self.first_commit_stamp is not None:
+            info["first_commit_stamp"] = self.first_commit_stamp
+            info["last_commit_stamp"] = self.last_commit_stamp
+        if self.last_active_day is not None:
+            info["last_active_day"] = formatday(self.last_active_day)
+            info["active_days"] = set(formatday(day)
+                                      for day in self.active_days)
+        return info
+
+
+class AuthorTable:
+    """
+    Authors interned as consecutive ids, with an AuthorInfo per id. The
+    aggregates of a collector refer to authors by id; names are only looked
+    up again when the report is written.
+    """
+    def __init__(self):
+        self.names = []  # id -> name
+        self.ids = {}  # name -> id
+        self.infos = []  # id -> AuthorInfo
+
+    def __len__(self):
+        return len(self.names)
+
+    def getid(self, name):
+        id = self.ids.get(name)
+        if id is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.infos.append(AuthorInfo())
+        return id
+
+    def getname(self, id):
+        return self.names[id]
+
+    ##
+    # Add the authors of `other`, which covers later commits. Returns the
+    # ids of this table for the ids of `other`.
+    def merge(self, other):
+        remap = []
+        for (name, info) in zip(other.names, other.infos):
+            id = self.getid(name)
+            self.infos[id].merge(info)
+            remap.append(id)
+        return remap
+
+    ##
+    # {name: value} of {id: value}
+    def expand(self, values):
+        return dict((self.names[id], value) for (id, value) in values.items())
+
+
+def formatday(day):
+    return datetime.date.fromordinal(day).strftime("%Y-%m-%d")
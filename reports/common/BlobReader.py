@@ -0,0 +1,63 @@
+import subprocess
+import threading
+
+from common import tracing
+
+
+class BlobReader:
+    """Streams blob contents from one long-lived `git cat-file --batch` process."""
+    def __init__(self, cwd=None):
+        self.span = tracing.span("git cat-file --batch", "command", cpu=False)
+        self.span.start()
+        self.process = subprocess.Popen(["git", "cat-file", "--batch"],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        cwd=cwd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, blob_ids):
+        stdin = self.process.stdin
+        for blob_id in blob_ids:
+            stdin.write(blob_id.encode() + b"\n")
+        stdin.flush()
+
+    ##
+    # Yield (blob_id, number of lines) for every blob, counting newlines
+    # in-process the same way `wc -l` does.
+    def iterlinecounts(self, blob_ids, chunksize=1 << 16):
+        # ids are fed from a separate thread so that neither pipe can fill up
+        # while the other side is waiting on it
+        writer = threading.Thread(target=self._write, args=(blob_ids, ))
+        writer.start()
+        stdout = self.process.stdout
+        try:
+            for blob_id in blob_ids:
+                header = stdout.readline().split()
+                if len(header) != 3:
+                    # "<id> missing" or "<id> ambiguous"
+                    print('Warning: cannot read blob "%s"' % blob_id)
+                    yield (blob_id, 0)
+                    continue
+                remaining = int(header[2])
+                count = 0
+                while remaining > 0:
+                    chunk = stdout.read(min(remaining, chunksize))
+                    if not chunk:
+                        raise EOFError("git cat-file exited early")
+                    count += chunk.count(b"\n")
+                    remaining -= len(chunk)
+                stdout.read(1)  # LF terminating the object contents
+                yield (blob_id, count)
+        finally:
+            writer.join()
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.span.wait(self.process)
+        self.span.stop()
@@ -0,0 +1,202 @@
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+from collections.abc import MutableMapping
+
+SQLITE_HEADER = b"SQLite format 3\0"
+
+
+class CacheStore:
+    """
+    Cache kept in a SQLite file. Entries are grouped in sections
+    (cache["files_in_tree"], cache["lines_in_blob"], ...) that are looked up
+    key by key instead of loading the whole file, and only entries added or
+    changed during the run are written back by save(). The collection
+    phases may use it from several threads at once.
+    """
+    def __init__(self):
+        self.path = None
+        self.db = None
+        self.sections = {}
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.sections:
+                self.sections[name] = CacheSection(self, name)
+            return self.sections[name]
+
+    ##
+    # Use the cache file at `path`; caches written by older versions as
+    # (compressed) pickles are converted once.
+    def open(self, path):
+        self.close()
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                header = f.read(len(SQLITE_HEADER))
+            if header != SQLITE_HEADER:
+                self.migrate(path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "section TEXT, key TEXT, value, "
+                        "PRIMARY KEY (section, key)) WITHOUT ROWID")
+
+    def migrate(self, path):
+        print("Converting cache to SQLite...")
+        f = open(path, "rb")
+        try:
+            cache = pickle.loads(zlib.decompress(f.read()))
+        except:
+            # non-compressed caches
+            f.seek(0)
+            cache = pickle.load(f)
+        f.close()
+        tempfile = path + ".tmp"
+        if os.path.exists(tempfile):
+            os.remove(tempfile)
+        db = sqlite3.connect(tempfile)
+        db.execute("CREATE TABLE entries ("
+                   "section TEXT, key TEXT, value, "
+                   "PRIMARY KEY (section, key)) WITHOUT ROWID")
+        for name, entries in cache.items():
+            db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                ((name, str(key), encodevalue(value))
+                 for (key, value) in entries.items()))
+        db.commit()
+        db.close()
+        os.replace(tempfile, path)
+
+    def lookup(self, name, key):
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM entries WHERE section = ? AND key = ?",
+                (name, key)).fetchone()
+        if row is None:
+            return None
+        return (decodevalue(row[0]), )
+
+    def keys(self, name):
+        if self.db is None:
+            return []
+        with self.lock:
+            return [
+                row[0] for row in self.db.execute(
+                    "SELECT key FROM entries WHERE section = ?", (name, ))
+            ]
+
+    ##
+    # Entries added, changed or deleted since the last save, as section ->
+    # (key -> value, deleted keys)
+    def pending(self):
+        return dict((name, (dict(section.pending), set(section.deleted)))
+                    for (name, section) in self.sections.items()
+                    if len(section.pending) > 0 or len(section.deleted) > 0)
+
+    ##
+    # Apply entries as returned by pending(), e.g. from another process
+    def update(self, entries):
+        for name, (values, deleted) in entries.items():
+            section = self[name]
+            for key in deleted:
+                section.pop(key, None)
+            section.update(values)
+
+    ##
+    # Write the entries added during this run to the cache file at `path`
+    def save(self, path):
+        if self.path != path:
+            self.open(path)
+        with self.lock, self.db:
+            for section in self.sections.values():
+                self.db.executemany(
+                    "DELETE FROM entries WHERE section = ? AND key = ?",
+                    ((section.name, key) for key in section.deleted))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                    ((section.name, key, encodevalue(value))
+                     for (key, value) in section.pending.items()))
+                section.flushed()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class CacheSection(MutableMapping):
+    """Dictionary-like view of one section of a CacheStore."""
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.pending = {}  # key -> value, not written yet
+        self.deleted = set()
+        self.loaded = {}  # key -> value, read from the cache file
+
+    def __getitem__(self, key):
+        key = str(key)
+        if key in self.pending:
+            return self.pending[key]
+        if key in self.loaded:
+            return self.loaded[key]
+        if key in self.deleted:
+            raise KeyError(key)
+        found = self.store.lookup(self.name, key)
+        if found is None:
+            raise KeyError(key)
+        self.loaded[key] = found[0]
+        return found[0]
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        self.deleted.discard(key)
+        self.loaded.pop(key, None)
+        self.pending[key] = value
+
+    def __delitem__(self, key):
+        self[key]  # raises KeyError for unknown keys
+        key = str(key)
+        self.pending.pop(key, None)
+        self.loaded.pop(key, None)
+        self.deleted.add(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        keys = set(self.store.keys(self.name)) - self.deleted
+        keys.update(self.pending)
+        return iter(keys)
+
+    def __len__(self):
+        return len(set(self))
+
+    def flushed(self):
+        self.loaded.update(self.pending)
+        self.pending = {}
+        self.deleted = set()
+
+
+##
+# Values are stored as SQLite integers/strings where possible, anything else
+# as a compressed pickle.
+def encodevalue(value):
+    if isinstance(value, (int, str)) and not isinstance(value, bool):
+        return value
+    return zlib.compress(pickle.dumps(value))
+
+
+def decodevalue(value):
+    if isinstance(value, bytes):
+        return pickle.loads(zlib.decompress(value))
+    return value
@@ -0,0 +1,107 @@
+import heapq
+
+
+class ChurnNode:
+    """Churn of one file or directory of a ChurnIndex."""
+    __slots__ = ("children", "file", "commits", "lines_added",
+                 "lines_removed", "authors")
+
+    def __init__(self):
+        self.children = None  # name -> ChurnNode, None for files
+        self.file = False  # changed as a file (not only as a directory)
+        self.commits = 0
+        self.lines_added = 0
+        self.lines_removed = 0
+        self.authors = set()
+
+    def getchild(self, name):
+        if self.children is None:
+            self.children = {}
+        child = self.children.get(name)
+        if child is None:
+            child = self.children[name] = ChurnNode()
+        return child
+
+
+class ChurnIndex:
+    """
+    Commits, lines added/removed and distinct authors per file, rolled up
+    to every directory above it in a path trie. The root stands for the
+    whole tree.
+    """
+    def __init__(self):
+        self.root = ChurnNode()
+
+    ##
+    # Add a commit by `author` (an id of the collector's AuthorTable)
+    # changing `changes` ([(path, added, removed)])
+    def addcommit(self, author, changes):
+        touched = set()  # ids of the nodes counted for this commit
+        for (path, added, removed) in changes:
+            node = self.root
+            nodes = [node]
+            for name in path.split("/"):
+                node = node.getchild(name)
+                nodes.append(node)
+            node.file = True
+            for node in nodes:
+                node.lines_added += added
+                node.lines_removed += removed
+                node.authors.add(author)
+                if id(node) not in touched:
+                    touched.add(id(node))
+                    node.commits += 1
+
+    ##
+    # Add the churn of `other`, which covers other commits. `authors` maps
+    # the author ids of `other` to those of this index (as returned by
+    # AuthorTable.merge()). Nothing of `other` is shared afterwards.
+    def merge(self, other, authors):
+        pending = [(self.root, other.root)]
+        while len(pending) > 0:
+            (node, add) = pending.pop()
+            node.file = node.file or add.file
+            node.commits += add.commits
+            node.lines_added += add.lines_added
+            node.lines_removed += add.lines_removed
+            node.authors.update(authors[author] for author in add.authors)
+            if add.children is not None:
+                for name, child in add.children.items():
+                    pending.append((node.getchild(name), child))
+
+    ##
+    # Yield (path, node) for every file and directory, except the root
+    def iternodes(self):
+        pending = [("", self.root)]
+        while len(pending) > 0:
+            (path, node) = pending.pop()
+            if node.children is None:
+                continue
+            for name, child in node.children.items():
+                childpath = path + name
+                yield (childpath, child)
+                pending.append((childpath + "/", child))
+
+    ##
+    # The `k` files (or directories with `files` false) with the most
+    # `key` (commits, lines_added, lines_removed or authors), all of them
+    # if `k` is 0, as report entries. Only the top `k` are kept while
+    # going through the trie, it is never sorted as a whole.
+    def top(self, k, key="commits", files=True):
+        if key == "authors":
+            value = lambda entry: (len(entry[1].authors), entry[0])
+        else:
+            value = lambda entry: (getattr(entry[1], key), entry[0])
+        nodes = ((path, node) for (path, node) in self.iternodes()
+                 if (node.file if files else node.children is not None))
+        if k > 0:
+            nodes = heapq.nlargest(k, nodes, key=value)
+        else:
+            nodes = sorted(nodes, key=value, reverse=True)
+        return [{
+            "path": path,
+            "commits": node.commits,
+            "lines_added": node.lines_added,
+            "lines_removed": node.lines_removed,
+            "authors": len(node.authors),
+        } for (path, node) in nodes]
@@ -0,0 +1,165 @@
+import heapq
+
+from array import array
+from .AuthorChanges import AuthorChanges
+
+
+class CommitGraph:
+    """
+    The commits of the history walks of one repository with their parents
+    and committer dates, as parallel arrays with one row per commit. Parts
+    of the history walked separately (history shards, incremental runs)
+    merge their graphs, and getorder() puts the merged commits in the order
+    a single `git log --date-order` walk over all of them gives, which the
+    aggregates depending on that order are computed in. Besides that, a row
+    holds what those aggregates need: author stamp and id, and files and
+    lines changed (0 for merges).
+    """
+    def __init__(self):
+        self.width = 20  # bytes of an object id
+        self.hashes = bytearray()  # object id of every row
+        self.parents = bytearray()  # object ids of the parents of all rows
+        self.parent_ends = array("q")  # row -> end of its parents in parents
+        self.dates = array("q")  # committer dates
+        self.stamps = array("q")  # author dates
+        self.authors = array("q")
+        self.files = array("q")
+        self.inserted = array("q")
+        self.deleted = array("q")
+        self.order = None  # see getorder()
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getstate__(self):
+        return dict(self.__dict__, order=None)
+
+    def gethash(self, row):
+        return bytes(self.hashes[row * self.width:(row + 1) * self.width])
+
+    ##
+    # Add `commit` (see common.aggregators.Commit) by author id `author`
+    def add(self, commit, author):
+        self.width = len(commit.hash) // 2
+        self.hashes += bytes.fromhex(commit.hash)
+        for parent in commit.parents:
+            self.parents += bytes.fromhex(parent)
+        self.parent_ends.append(len(self.parents))
+        self.dates.append(commit.committer_stamp)
+        self.stamps.append(commit.stamp)
+        self.authors.append(author)
+        if commit.is_merge():
+            self.files.append(0)
+            self.inserted.append(0)
+            self.deleted.append(0)
+        else:
+            self.files.append(commit.files)
+            self.inserted.append(commit.inserted)
+            self.deleted.append(commit.deleted)
+        self.order = None
+
+    ##
+    # Add the rows of `other`, another part of the history. `authors` maps
+    # the author ids of `other` to those of this graph.
+    def merge(self, other, authors):
+        if len(other) == 0:
+            return
+        self.width = other.width
+        offset = len(self.parents)
+        self.hashes += other.hashes
+        self.parents += other.parents
+        self.parent_ends.extend(end + offset for end in other.parent_ends)
+        self.dates.extend(other.dates)
+        self.stamps.extend(other.stamps)
+        self.authors.extend(authors[author] for author in other.authors)
+        self.files.extend(other.files)
+        self.inserted.extend(other.inserted)
+        self.deleted.extend(other.deleted)
+        self.order = None
+
+    ##
+    # Rows in the order of `git log --date-order`, newest first: a commit
+    # comes after all of its children, the latest committer date first of
+    # the commits whose children are done, the one queued first on equal
+    # dates. The order only depends on the commits in the graph, not on the
+    # order they were added in.
+    def getorder(self):
+        if self.order is not None:
+            return self.order
+        width = self.width
+        rows = dict((self.gethash(row), row) for row in range(len(self)))
+        parents = []  # row -> rows of its parents in the graph
+        children = [0] * len(self)  # row -> children in the graph
+        start = 0
+        for end in self.parent_ends:
+            parent_rows = []
+            for i in range(start, end, width):
+                parent = rows.get(bytes(self.parents[i:i + width]))
+                if parent is not None:
+                    parent_rows.append(parent)
+                    children[parent] += 1
+            parents.append(parent_rows)
+            start = end
+
+        # (-committer date, queued, row), starting from the commits without
+        # children in the graph (the walked head)
+        tips = sorted((row for row in range(len(self)) if children[row] == 0),
+                      key=lambda row: (-self.dates[row], self.gethash(row)))
+        queue = [(-self.dates[row], queued, row)
+                 for (queued, row) in enumerate(tips)]
+        queued = len(queue)
+        order = array("q")
+        while len(queue) > 0:
+            (_, _, row) = heapq.heappop(queue)
+            order.append(row)
+            for parent in parents[row]:
+                children[parent] -= 1
+                if children[parent] == 0:
+                    heapq.heappush(queue, (-self.dates[parent], queued, parent))
+                    queued += 1
+        self.order = order
+        return order
+
+    ##
+    # Lines added and commits of every author after each of their commits,
+    # in walk order from the oldest commit. Stamps never go back in time,
+    # so that clock skew does not give ugly graphs.
+    def getauthorchanges(self):
+        changes = AuthorChanges()
+        lines_added = {}  # author -> lines added so far
+        commits = {}  # author -> commits so far
+        stamp = 0
+        for row in reversed(self.getorder()):
+            stamp = max(stamp, self.stamps[row])
+            author = self.authors[row]
+            lines_added[author] = (lines_added.get(author, 0) +
+                                   self.inserted[row])
+            commits[author] = commits.get(author, 0) + 1
+            changes.add(stamp, author, lines_added[author], commits[author])
+        return changes
+
+    ##
+    # stamp -> {files, ins, del, lines} of every commit in walk order from
+    # the oldest, lines being the lines added minus removed up to it
+    def getlinechanges(self):
+        changes = {}
+        lines = 0
+        for row in reversed(self.getorder()):
+            lines += self.inserted[row] - self.deleted[row]
+            changes[self.stamps[row]] = {
+                "files": self.files[row],
+                "ins": self.inserted[row],
+                "del": self.deleted[row],
+                "lines": lines,
+            }
+        return changes
+
+    ##
+    # The row of the last commit in walk order and author id -> row of the
+    # last commit of the author
+    def getlastrows(self):
+        order = self.getorder()
+        last = {}
+        for row in order:
+            last[self.authors[row]] = row
+        return (order[-1], last)
@@ -0,0 +1,92 @@
+from array import array
+
+from .utils import getextension
+
+# interned columns, as column -> ids
+NAMED_COLUMNS = ("author", "domain", "timezone", "extension")
+
+
+class CommitSeries:
+    """
+    Every walked commit as columns: stamp, author, domain, timezone, merge
+    flag, files changed and lines added/removed (none for merges, their
+    changes are counted on the branches they merge), plus one row per
+    commit and extension with the lines added/removed in files of that
+    extension. Names are interned as ids; rows are in walk order.
+    """
+    def __init__(self):
+        self.stamps = array("q")
+        self.authors = array("q")
+        self.domains = array("q")
+        self.timezones = array("q")
+        self.merges = array("b")
+        self.files = array("q")
+        self.inserted = array("q")
+        self.deleted = array("q")
+        # per commit and extension
+        self.ext_rows = array("q")  # row of the commit
+        self.ext_ids = array("q")
+        self.ext_inserted = array("q")
+        self.ext_deleted = array("q")
+        self.names = dict((column, []) for column in NAMED_COLUMNS)
+        self.ids = dict((column, {}) for column in NAMED_COLUMNS)
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def getid(self, column, name):
+        ids = self.ids[column]
+        id = ids.get(name)
+        if id is None:
+            id = ids[name] = len(self.names[column])
+            self.names[column].append(name)
+        return id
+
+    def add(self, commit):
+        row = len(self.stamps)
+        merge = commit.is_merge()
+        self.stamps.append(commit.stamp)
+        self.authors.append(self.getid("author", commit.author))
+        self.domains.append(self.getid("domain", commit.domain))
+        self.timezones.append(self.getid("timezone", commit.timezone))
+        self.merges.append(merge)
+        if merge:
+            self.files.append(0)
+            self.inserted.append(0)
+            self.deleted.append(0)
+            return
+        self.files.append(commit.files)
+        self.inserted.append(commit.inserted)
+        self.deleted.append(commit.deleted)
+        extensions = {}  # extension -> [added, removed]
+        for (path, added, removed) in commit.paths:
+            ext = getextension(path)
+            if ext not in extensions:
+                extensions[ext] = [0, 0]
+            extensions[ext][0] += added
+            extensions[ext][1] += removed
+        for ext, (added, removed) in extensions.items():
+            self.ext_rows.append(row)
+            self.ext_ids.append(self.getid("extension", ext))
+            self.ext_inserted.append(added)
+            self.ext_deleted.append(removed)
+
+    ##
+    # Append the commits of `other`. Nothing of `other` is shared afterwards.
+    def merge(self, other):
+        offset = len(self.stamps)
+        remap = dict((column, [self.getid(column, name) for name in names])
+                     for (column, names) in other.names.items())
+        self.stamps.extend(other.stamps)
+        self.authors.extend(remap["author"][id] for id in other.authors)
+        self.domains.extend(remap["domain"][id] for id in other.domains)
+        self.timezones.extend(remap["timezone"][id]
+                              for id in other.timezones)
+        self.merges.extend(other.merges)
+        self.files.extend(other.files)
+        self.inserted.extend(other.inserted)
+        self.deleted.extend(other.deleted)
+        self.ext_rows.extend(row + offset for row in other.ext_rows)
+        self.ext_ids.extend(remap["extension"][id] for id in other.ext_ids)
+        self.ext_inserted.extend(other.ext_inserted)
+        self.ext_deleted.extend(other.ext_deleted)
@@ -1,23 +1,24 @@
 import datetime
-import getopt
-import glob
 import os
-import pickle
-import platform
-import re
-import shutil
-import subprocess
-import sys
 import time
-import zlib
-import json
+
+from .AuthorChanges import AuthorChanges
+from .AuthorTable import AuthorTable
+from .CacheStore import CacheStore
+from .ChurnIndex import ChurnIndex
+from .CommitGraph import CommitGraph
+from .CommitSeries import CommitSeries
 from .constans import conf
+from .utils import mergecounts
+from . import tracing
+
 
 class DataCollector:
     """Manages data collection from a revision control repository."""
     def __init__(self):
         self.stamp_created = time.time()
-        self.cache = {}
+        self.dir = None
+        self.cache = CacheStore()
         self.total_authors = 0
         self.activity_by_hour_of_day = {}  # hour -> commits
         self.activity_by_day_of_week = {}  # day -> commits
@@ -28,9 +29,10 @@ class DataCollector:
         self.activity_by_year_week = {}  # yy_wNN -> commits
         self.activity_by_year_week_peak = 0
 
-        self.authors = (
-            {}
-        )  # name -> {commits, first_commit_stamp, last_commit_stamp, last_active_day, active_days, lines_added, lines_removed}
+        # authors by id, the aggregates below refer to them by id (see
+        # common.AuthorTable)
+        self.authors = AuthorTable()
+        self.author_info = {}  # name -> report entry, see refine()
 
         self.total_commits = 0
         self.total_files = 0
@@ -40,8 +42,8 @@ class DataCollector:
         self.domains = {}  # domain -> commits
 
         # author of the month
-        self.author_of_month = {}  # month -> author -> commits
-        self.author_of_year = {}  # year -> author -> commits
+        self.author_of_month = {}  # month -> author id -> commits
+        self.author_of_year = {}  # year -> author id -> commits
         self.commits_by_month = {}  # month -> commits
         self.commits_by_year = {}  # year -> commits
         self.lines_added_by_month = {}  # month -> lines added
@@ -72,8 +74,67 @@ class DataCollector:
         # extensions
         self.extensions = {}  # extension -> files, lines
 
+        # ownership: lines at the head by the author who last changed them
+        self.ownership_by_author = {}  # author -> lines
+        self.ownership_by_extension = {}  # extension -> author -> lines
+
         # line statistics
         self.changes_by_date = {}  # stamp -> { files, ins, del }
+        # lines added and commits of an author after each of their commits
+        self.changes_by_date_by_author = AuthorChanges()
+
+        # commits, lines added/removed and authors per file and directory
+        self.churn = ChurnIndex()
+
+        # every commit as a row, for the query server
+        self.commit_series = CommitSeries()
+
+        # the walked commits, for the aggregates depending on the walk order
+        self.commit_graph = CommitGraph()
+
+        # keys of the cache["history"] entries merged into the aggregates,
+        # in the order merged (see GitDataCollector.collectHistory())
+        self.history_keys = []
+
+    # aggregates built from the commit history, kept in the cache between runs
+    # together with history_version, which changes with their layout
+    history_version = 4
+    history_fields = (
+        "total_authors",
+        "activity_by_hour_of_day",
+        "activity_by_day_of_week",
+        "activity_by_month_of_year",
+        "activity_by_hour_of_week",
+        "activity_by_hour_of_day_busiest",
+        "activity_by_hour_of_week_busiest",
+        "activity_by_year_week",
+        "activity_by_year_week_peak",
+        "authors",
+        "total_commits",
+        "domains",
+        "author_of_month",
+        "author_of_year",
+        "commits_by_month",
+        "commits_by_year",
+        "lines_added_by_month",
+        "lines_added_by_year",
+        "lines_removed_by_month",
+        "lines_removed_by_year",
+        "first_commit_stamp",
+        "last_commit_stamp",
+        "last_active_day",
+        "active_days",
+        "total_lines",
+        "total_lines_added",
+        "total_lines_removed",
+        "commits_by_timezone",
+        "files_by_stamp",
+        "changes_by_date",
+        "changes_by_date_by_author",
+        "churn",
+        "commit_series",
+        "commit_graph",
+    )
 
     ##
     # This should be the main function to extract data from the repository.
@@ -87,17 +148,123 @@ class DataCollector:
     ##
     # Load cacheable data
     def loadCache(self, cachefile):
-        if not os.path.exists(cachefile):
-            return
         print("Loading cache...")
-        f = open(cachefile, "rb")
-        try:
-            self.cache = pickle.loads(zlib.decompress(f.read()))
-        except:
-            # temporary hack to upgrade non-compressed caches
-            f.seek(0)
-            self.cache = pickle.load(f)
-        f.close()
+        with tracing.span("cache_load"):
+            self.cache.open(cachefile)
+
+    ##
+    # Get the history aggregates as a dictionary of field -> value
+    def getHistoryState(self):
+        return dict((field, getattr(self, field))
+                    for field in self.history_fields)
+
+    def setHistoryState(self, state):
+        for field in self.history_fields:
+            setattr(self, field, state[field])
+
+    ##
+    # Fold the aggregates of another collector into this one. `other` is
+    # treated as the later part of the history, so cumulative series
+    # (changes_by_date, changes_by_date_by_author) continue from the totals
+    # of this collector. The commit graph is left out; parts of the history
+    # of one repository are merged with GitDataCollector.mergeHistory().
+    # Nothing of `other` is shared with this collector afterwards.
+    def merge(self, other):
+        lines_offset = self.total_lines
+        author_offsets = [(info.lines_added, info.commits)
+                          for info in self.authors.infos]
+
+        # activity
+        mergecounts(self.activity_by_hour_of_day,
+                    other.activity_by_hour_of_day)
+        mergecounts(self.activity_by_day_of_week,
+                    other.activity_by_day_of_week)
+        mergecounts(self.activity_by_month_of_year,
+                    other.activity_by_month_of_year)
+        for day, hours in other.activity_by_hour_of_week.items():
+            if day not in self.activity_by_hour_of_week:
+                self.activity_by_hour_of_week[day] = {}
+            mergecounts(self.activity_by_hour_of_week[day], hours)
+        mergecounts(self.activity_by_year_week, other.activity_by_year_week)
+        self.activity_by_hour_of_day_busiest = max(
+            self.activity_by_hour_of_day.values(), default=0)
+        self.activity_by_hour_of_week_busiest = max(
+            (commits for hours in self.activity_by_hour_of_week.values()
+             for commits in hours.values()),
+            default=0)
+        self.activity_by_year_week_peak = max(
+            self.activity_by_year_week.values(), default=0)
+
+        # authors, `authors` maps the ids of `other` to those of this collector
+        authors = self.authors.merge(other.authors)
+        self.total_authors = len(self.authors)
+        self.total_commits += other.total_commits
+
+        for domain, info in other.domains.items():
+            if domain not in self.domains:
+                self.domains[domain] = {}
+            mergecounts(self.domains[domain], info)
+
+        # author of the month/year
+        for month, counts in other.author_of_month.items():
+            if month not in self.author_of_month:
+                self.author_of_month[month] = {}
+            mergecounts(self.author_of_month[month],
+                        dict((authors[author], commits)
+                             for (author, commits) in counts.items()))
+        for year, counts in other.author_of_year.items():
+            if year not in self.author_of_year:
+                self.author_of_year[year] = {}
+            mergecounts(self.author_of_year[year],
+                        dict((authors[author], commits)
+                             for (author, commits) in counts.items()))
+        mergecounts(self.commits_by_month, other.commits_by_month)
+        mergecounts(self.commits_by_year, other.commits_by_year)
+        mergecounts(self.lines_added_by_month, other.lines_added_by_month)
+        mergecounts(self.lines_added_by_year, other.lines_added_by_year)
+        mergecounts(self.lines_removed_by_month, other.lines_removed_by_month)
+        mergecounts(self.lines_removed_by_year, other.lines_removed_by_year)
+
+        if other.first_commit_stamp != 0 and (
+                self.first_commit_stamp == 0
+                or other.first_commit_stamp < self.first_commit_stamp):
+            self.first_commit_stamp = other.first_commit_stamp
+        self.last_commit_stamp = max(self.last_commit_stamp,
+                                     other.last_commit_stamp)
+        if self.last_active_day is None:
+            self.last_active_day = other.last_active_day
+        self.active_days |= other.active_days
+
+        # lines, size and files
+        self.total_lines += other.total_lines
+        self.total_lines_added += other.total_lines_added
+        self.total_lines_removed += other.total_lines_removed
+        self.total_size += other.total_size
+        self.total_files += other.total_files
+        mergecounts(self.commits_by_timezone, other.commits_by_timezone)
+        for tag, info in other.tags.items():
+            self.tags[tag] = dict(info, authors=dict(info["authors"]))
+        self.files_by_stamp.update(other.files_by_stamp)
+        for ext, info in other.extensions.items():
+            if ext not in self.extensions:
+                self.extensions[ext] = {"files": 0, "lines": 0}
+            mergecounts(self.extensions[ext], info)
+        mergecounts(self.ownership_by_author, other.ownership_by_author)
+        for ext, lines in other.ownership_by_extension.items():
+            if ext not in self.ownership_by_extension:
+                self.ownership_by_extension[ext] = {}
+            mergecounts(self.ownership_by_extension[ext], lines)
+
+        # line statistics
+        self.churn.merge(other.churn, authors)
+        self.commit_series.merge(other.commit_series)
+        self.history_keys.extend(other.history_keys)
+        for stamp, changes in other.changes_by_date.items():
+            self.changes_by_date[stamp] = dict(changes,
+                                               lines=changes["lines"] +
+                                               lines_offset)
+        self.changes_by_date_by_author.merge(other.changes_by_date_by_author,
+                                             authors, author_offsets)
 
     ##
     # Produce any additional statistics from the extracted data.
@@ -152,14 +319,5 @@ class DataCollector:
     # Save cacheable data
     def saveCache(self, cachefile):
         print("Saving cache...")
-        tempfile = cachefile + ".tmp"
-        f = open(tempfile, "wb")
-        # pickle.dump(self.cache, f)
-        data = zlib.compress(pickle.dumps(self.cache))
-        f.write(data)
-        f.close()
-        try:
-            os.remove(cachefile)
-        except OSError:
-            pass
-        os.rename(tempfile, cachefile)
+        with tracing.span("cache_save"):
+            self.cache.save(cachefile)
@@ -1,474 +1,593 @@
+import asyncio
 import datetime
 import re
 import os
-import json
+import subprocess
+import time
 
-from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+from multiprocessing import get_context
 from .DataCollector import DataCollector
-from .utils import (getpipeoutput, getlogrange, getnumoffilesfromrev, getcommitrange, 
-getnumoflinesinblob, getstatsummarycounts, getkeyssortedbyvaluekey)
-from .constans import FIND_CMD, GREP_CMD, conf
+from .aggregators import (LOG_FORMAT, LOG_OPTIONS, NUMSTAT_OPTIONS, numpy,
+                          parsecommits,
+                          ActivityAggregator, AuthorsAggregator,
+                          DomainsAggregator, TimezoneAggregator,
+                          ColumnarActivityAggregator, FilesAggregator,
+                          LineStatsAggregator, AuthorStatsAggregator,
+                          ChurnAggregator, CommitSeriesAggregator,
+                          CommitGraphAggregator)
+from .utils import (getpipeoutput, getpipeoutputstream,
+                    getpipeoutputstreamasync, getlogrange, getcommitrange,
+                    getnumoflinesinblobs, getkeyssortedbyvaluekey,
+                    getextension, getblame, mergecounts)
+from .executor import getexecutor, closeexecutor
+from .columnar import SERIES_FORMATS
+from .JsonWriter import JsonWriter
+from .ObjectDatabase import ObjectDatabase
+from .RangeIndex import RangeIndex
+from .metrics import getphases, getsections
+from . import tracing
+from .constans import conf
 
 
 class GitDataCollector(DataCollector):
+    def __init__(self):
+        DataCollector.__init__(self)
+        self.objects = None  # see getObjects()
+
     def collect(self, dir):
         DataCollector.collect(self, dir)
+        asyncio.run(self.collectPhases(dir))
 
-        
-
-        self.total_authors += int(
-            getpipeoutput(["git shortlog -s %s" % getlogrange(), FIND_CMD]))
-        # self.total_lines = int(getoutput('git-ls-files -z |xargs -0 cat |find /c /v \"\"'))
-
-        # tags
-        lines = getpipeoutput(["git show-ref --tags"]).split("\n")
-        for line in lines:
-            if len(line) == 0:
-                continue
-            (hash, tag) = line.split(" ")
-
-            tag = tag.replace("refs/tags/", "")
-            output = getpipeoutput(
-                ['git log "%s" --pretty=format:"%%at %%aN" -n 1' % hash])
-            if len(output) > 0:
-                parts = output.split(" ")
-                stamp = 0
-                try:
-                    stamp = int(parts[0])
-                except ValueError:
-                    stamp = 0
-                self.tags[tag] = {
-                    "stamp":
-                    stamp,
-                    "hash":
-                    hash,
-                    "date":
-                    datetime.datetime.fromtimestamp(stamp).strftime(
-                        "%Y-%m-%d"),
-                    "commits":
-                    0,
-                    "authors": {},
-                }
-
-        # collect info on tags, starting from latest
-        tags_sorted_by_date_desc = map(
-            lambda el: el[1],
-            reversed(
-                sorted(
-                    map(lambda el: (el[1]["date"], el[0]),
-                        self.tags.items()))),
-        )
-        prev = None
-        for tag in reversed(list(tags_sorted_by_date_desc)):
-            cmd = 'git shortlog -s "%s"' % tag
-            if prev != None:
-                cmd += ' "^%s"' % prev
-            output = getpipeoutput([cmd])
-            if len(output) == 0:
-                continue
-            prev = tag
-            for line in output.split("\n"):
-                parts = re.split(r"\s+", line, 2)
-                commits = int(parts[1])
-                author = parts[2]
-                self.tags[tag]["commits"] += commits
-                self.tags[tag]["authors"][author] = commits
-
-        # Collect revision statistics
-        # Outputs "<stamp> <date> <time> <timezone> <author> '<' <mail> '>'"
-        lines = getpipeoutput([
-            'git rev-list --pretty=format:"%%at %%ai %%aN <%%aE>" %s' %
-            getlogrange("HEAD"),
-            GREP_CMD + " -v ^commit",
-        ]).split("\n")
-        for line in lines:
-            parts = line.split(" ", 4)
-            author = ""
+    ##
+    # The in-process object database of the repository with
+    # conf["object_backend"] = "python", None to run git instead
+    def getObjects(self):
+        if self.objects is None and conf["object_backend"] == "python":
             try:
-                stamp = int(parts[0])
-            except ValueError:
-                stamp = 0
-            timezone = parts[3]
-            author, mail = parts[4].split("<", 1)
-            author = author.rstrip()
-            mail = mail.rstrip(">")
-            domain = "?"
-            if mail.find("@") != -1:
-                domain = mail.rsplit("@", 1)[1]
-            date = datetime.datetime.fromtimestamp(float(stamp))
-
-            # First and last commit stamp (may be in any order because of cherry-picking and patches)
-            if stamp > self.last_commit_stamp:
-                self.last_commit_stamp = stamp
-            if self.first_commit_stamp == 0 or stamp < self.first_commit_stamp:
-                self.first_commit_stamp = stamp
-
-            # activity
-            # hour
-            hour = date.hour
-            self.activity_by_hour_of_day[hour] = (
-                self.activity_by_hour_of_day.get(hour, 0) + 1)
-            # most active hour?
-            if (self.activity_by_hour_of_day[hour] >
-                    self.activity_by_hour_of_day_busiest):
-                self.activity_by_hour_of_day_busiest = self.activity_by_hour_of_day[
-                    hour]
-
-            # day of week
-            day = date.weekday()
-            self.activity_by_day_of_week[day] = (
-                self.activity_by_day_of_week.get(day, 0) + 1)
-
-            # domain stats
-            if domain not in self.domains:
-                self.domains[domain] = {}
-            # commits
-            self.domains[domain]["commits"] = self.domains[domain].get(
-                "commits", 0) + 1
-
-            # hour of week
-            if day not in self.activity_by_hour_of_week:
-                self.activity_by_hour_of_week[day] = {}
-            self.activity_by_hour_of_week[day][hour] = (
-                self.activity_by_hour_of_week[day].get(hour, 0) + 1)
-            # most active hour?
-            if (self.activity_by_hour_of_week[day][hour] >
-                    self.activity_by_hour_of_week_busiest):
-                self.activity_by_hour_of_week_busiest = self.activity_by_hour_of_week[
-                    day][hour]
-
-            # month of year
-            month = date.month
-            self.activity_by_month_of_year[month] = (
-                self.activity_by_month_of_year.get(month, 0) + 1)
-
-            # yearly/weekly activity
-            yyw = date.strftime("%Y-%W")
-            self.activity_by_year_week[yyw] = self.activity_by_year_week.get(
-                yyw, 0) + 1
-            if self.activity_by_year_week_peak < self.activity_by_year_week[
-                    yyw]:
-                self.activity_by_year_week_peak = self.activity_by_year_week[
-                    yyw]
-
-            # author stats
-            if author not in self.authors:
-                self.authors[author] = {}
-            # commits, note again that commits may be in any date order because of cherry-picking and patches
-            if "last_commit_stamp" not in self.authors[author]:
-                self.authors[author]["last_commit_stamp"] = stamp
-            if stamp > self.authors[author]["last_commit_stamp"]:
-                self.authors[author]["last_commit_stamp"] = stamp
-            if "first_commit_stamp" not in self.authors[author]:
-                self.authors[author]["first_commit_stamp"] = stamp
-            if stamp < self.authors[author]["first_commit_stamp"]:
-                self.authors[author]["first_commit_stamp"] = stamp
-
-            # author of the month/year
-            yymm = date.strftime("%Y-%m")
-            if yymm in self.author_of_month:
-                self.author_of_month[yymm][author] = (
-                    self.author_of_month[yymm].get(author, 0) + 1)
-            else:
-                self.author_of_month[yymm] = {}
-                self.author_of_month[yymm][author] = 1
-            self.commits_by_month[yymm] = self.commits_by_month.get(yymm,
-                                                                    0) + 1
-
-            yy = date.year
-            if yy in self.author_of_year:
-                self.author_of_year[yy][author] = (
-                    self.author_of_year[yy].get(author, 0) + 1)
-            else:
-                self.author_of_year[yy] = {}
-                self.author_of_year[yy][author] = 1
-            self.commits_by_year[yy] = self.commits_by_year.get(yy, 0) + 1
-
-            # authors: active days
-            yymmdd = date.strftime("%Y-%m-%d")
-            if "last_active_day" not in self.authors[author]:
-                self.authors[author]["last_active_day"] = yymmdd
-                self.authors[author]["active_days"] = set([yymmdd])
-            elif yymmdd != self.authors[author]["last_active_day"]:
-                self.authors[author]["last_active_day"] = yymmdd
-                self.authors[author]["active_days"].add(yymmdd)
-
-            # project: active days
-            if yymmdd != self.last_active_day:
-                self.last_active_day = yymmdd
-                self.active_days.add(yymmdd)
-
-            # timezone
-            self.commits_by_timezone[timezone] = (
-                self.commits_by_timezone.get(timezone, 0) + 1)
-
-        # outputs "<stamp> <files>" for each revision
-        revlines = (getpipeoutput([
-            'git rev-list --pretty=format:"%%at %%T" %s' % getlogrange("HEAD"),
-            GREP_CMD + " -v ^commit",
-        ]).strip().split("\n"))
-        lines = []
-        revs_to_read = []
-        time_rev_count = []
-        # Look up rev in cache and take info from cache if found
-        # If not append rev to list of rev to read from repo
-        for revline in revlines:
-            time, rev = revline.split(" ")
-            # if cache empty then add time and rev to list of new rev's
-            # otherwise try to read needed info from cache
-            if "files_in_tree" not in self.cache.keys():
-                revs_to_read.append((time, rev))
-                continue
-            if rev in self.cache["files_in_tree"].keys():
-                lines.append("%d %d" %
-                             (int(time), self.cache["files_in_tree"][rev]))
-            else:
-                revs_to_read.append((time, rev))
-
-        # Read revisions from repo
-        pool = Pool(processes=conf["processes"])
-        time_rev_count = pool.map(getnumoffilesfromrev, revs_to_read)
-        pool.terminate()
-        pool.join()
-
-        # Update cache with new revisions and append then to general list
-        for (time, rev, count) in time_rev_count:
-            if "files_in_tree" not in self.cache:
-                self.cache["files_in_tree"] = {}
-            self.cache["files_in_tree"][rev] = count
-            lines.append("%d %d" % (int(time), count))
-
-        self.total_commits += len(lines)
-        for line in lines:
-            parts = line.split(" ")
-            if len(parts) != 2:
-                continue
-            (stamp, files) = parts[0:2]
-            try:
-                self.files_by_stamp[int(stamp)] = int(files)
-            except ValueError:
-                print('Warning: failed to parse line "%s"' % line)
-
-        # extensions and size of files
-        lines = getpipeoutput([
-            "git ls-tree -r -l -z %s" % getcommitrange("HEAD", end_only=True)
-        ]).split("\000")
-        blobs_to_read = []
-        for line in lines:
-            if len(line) == 0:
-                continue
-            parts = re.split(r"\s+", line, 4)
-            if parts[0] == "160000" and parts[3] == "-":
-                # skip submodules
-                continue
-            blob_id = parts[2]
-            size = int(parts[3])
-            fullpath = parts[4]
+                self.objects = ObjectDatabase(self.dir)
+            except (OSError, ValueError) as e:
+                print("Warning: reading objects through git: %s" % e)
+                self.objects = False
+        return self.objects or None
+
+    ##
+    # Tags, history and files do not depend on each other, so their git
+    # commands run concurrently: tags and files as coroutines reading
+    # their commands' output as it arrives, the history walk (which hands
+    # work to worker processes and the shared executor) in a thread.
+    async def collectPhases(self, dir):
+        self.getObjects()
+
+        # the phases share the event loop thread, so only their wall time
+        # is their own
+        async def phase(name, coroutine):
+            with tracing.span(name, cpu=False):
+                return await coroutine
+
+        # only the phases the requested metrics need (see common.metrics)
+        phases = getphases()
+
+        async def nothing():
+            return None
+
+        # ownership blames the files listed by the files phase
+        async def files():
+            files = await phase("files", self.collectFilesAsync())
+            if "ownership" in phases:
+                await phase("ownership",
+                            asyncio.to_thread(self.collectOwnership, files))
+
+        results = await asyncio.gather(
+            phase("tags", self.collectTagsAsync())
+            if "tags" in phases else nothing(),
+            phase("history", asyncio.to_thread(self.collectHistory, dir))
+            if "history" in phases else nothing(),
+            files() if "files" in phases else nothing(),
+            return_exceptions=True)
+        # a failed phase is only raised once the others are done, so that
+        # none of them is cancelled while it starts a git process
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        (_, part, _) = results
+
+        # history aggregates of this repository, folded into the data of
+        # all repositories
+        if part is not None:
+            self.merge(part)
+
+    def collectFiles(self):
+        return asyncio.run(self.collectFilesAsync())
+
+    ##
+    # Collect extensions, size and number of lines of the files at the head,
+    # from the object database if it is used and `git ls-tree` otherwise.
+    # Returns the files as [(blob id, size, path)].
+    async def collectFilesAsync(self):
+        objects = self.getObjects()
+        rev = getcommitrange("HEAD", end_only=True)
+        head = objects.resolve(rev) if objects is not None else None
+        files = []  # (blob id, size, path)
+        if head is not None:
+            def listfiles():
+                for (mode, blob_id, path) in objects.iterfiles(head):
+                    if mode == "160000":
+                        # skip submodules
+                        continue
+                    files.append((blob_id, objects.size(blob_id),
+                                  path.decode("utf-8", "replace")))
+
+            await asyncio.to_thread(listfiles)
+        else:
+            lines = getpipeoutputstreamasync(
+                ["git", "ls-tree", "-r", "-l", "-z", rev, "--"],
+                separator=b"\0",
+                cwd=self.dir)
+            async for line in lines:
+                if len(line) == 0:
+                    continue
+                line = line.decode("utf-8", "replace")
+                parts = re.split(r"\s+", line, 4)
+                if parts[0] == "160000" and parts[3] == "-":
+                    # skip submodules
+                    continue
+                files.append((parts[2], int(parts[3]), parts[4]))
 
+        blobs_to_read = []
+        lines_in_blob = self.cache["lines_in_blob"]
+        for (blob_id, size, fullpath) in files:
             self.total_size += size
             self.total_files += 1
 
-            filename = fullpath.split("/")[-1]  # strip directories
-            if filename.find(".") == -1 or filename.rfind(".") == 0:
-                ext = ""
-            else:
-                ext = filename[(filename.rfind(".") + 1):]
-            if len(ext) > conf["max_ext_length"]:
-                ext = ""
+            ext = getextension(fullpath)
             if ext not in self.extensions:
                 self.extensions[ext] = {"files": 0, "lines": 0}
             self.extensions[ext]["files"] += 1
-            # if cache empty then add ext and blob id to list of new blob's
-            # otherwise try to read needed info from cache
-            if "lines_in_blob" not in self.cache.keys():
-                blobs_to_read.append((ext, blob_id))
-                continue
-            if blob_id in self.cache["lines_in_blob"].keys():
-                self.extensions[ext]["lines"] += self.cache["lines_in_blob"][
-                    blob_id]
+            # try to read needed info from cache, otherwise add ext and
+            # blob id to list of new blob's
+            linecount = lines_in_blob.get(blob_id)
+            if linecount is not None:
+                self.extensions[ext]["lines"] += linecount
             else:
                 blobs_to_read.append((ext, blob_id))
 
         # Get info abount line count for new blob's that wasn't found in cache
-        pool = Pool(processes=conf["processes"])
-        ext_blob_linecount = pool.map(getnumoflinesinblob, blobs_to_read)
-        pool.terminate()
-        pool.join()
+        if "blob_lines" not in getphases():
+            ext_blob_linecount = ()
+        elif head is not None:
+            ext_blob_linecount = (
+                (ext, blob_id, objects.read(blob_id, False)[1].count(b"\n"))
+                for (ext, blob_id) in blobs_to_read)
+        else:
+            ext_blob_linecount = getnumoflinesinblobs(blobs_to_read,
+                                                      cwd=self.dir)
 
         # Update cache and write down info about number of number of lines
-        for (ext, blob_id, linecount) in ext_blob_linecount:
-            if "lines_in_blob" not in self.cache:
-                self.cache["lines_in_blob"] = {}
-            self.cache["lines_in_blob"][blob_id] = linecount
-            self.extensions[ext]["lines"] += self.cache["lines_in_blob"][
-                blob_id]
-
-        # line statistics
-        # outputs:
-        #  N files changed, N insertions (+), N deletions(-)
-        # <stamp> <author>
-        self.changes_by_date = {}  # stamp -> { files, ins, del }
-        # computation of lines of code by date is better done
-        # on a linear history.
-        extra = ""
-        if conf["linear_linestats"]:
-            extra = "--first-parent -m"
-        lines = getpipeoutput([
-            'git log --shortstat %s --pretty=format:"%%at %%aN" %s' %
-            (extra, getlogrange("HEAD"))
-        ]).split("\n")
-        lines.reverse()
-        files = 0
-        inserted = 0
-        deleted = 0
-        total_lines = 0
-        author = None
-        for line in lines:
+        # as the counts arrive
+        def count():
+            for (ext, blob_id, linecount) in ext_blob_linecount:
+                lines_in_blob[blob_id] = linecount
+                self.extensions[ext]["lines"] += linecount
+
+        await asyncio.to_thread(count)
+        return files
+
+    ##
+    # Collect the lines of the files at the head by the author who last
+    # changed them (`git blame`). Blames are cached by repository, path and
+    # blob, next to the head they were taken at and the blob of every path
+    # then. A rerun only blames the paths `git diff` lists between that
+    # head and the current one, and paths not blamed before; entries of
+    # paths blamed again or gone are dropped.
+    def collectOwnership(self, files):
+        rev = self.getHead()
+        blame = self.cache["blame"]
+        repository = os.path.abspath(self.dir)
+        previous = blame.get(repository)  # {"head", "blobs": path -> blob}
+        changed = set()
+        if previous is None:
+            previous = {"head": None, "blobs": {}}
+        elif previous["head"] != rev:
+            changed = self.getChangedPaths(previous["head"], rev)
+
+        def getkey(path, blob_id):
+            return "%s|%s %s" % (repository, blob_id, path)
+
+        to_blame = []
+        blobs = {}  # path -> blob of the files at the head
+        for (blob_id, _, path) in files:
+            blobs[path] = blob_id
+            owners = None
+            if (changed is not None and path not in changed
+                    and previous["blobs"].get(path) == blob_id):
+                owners = blame.get(getkey(path, blob_id))
+            if owners is not None:
+                self.addOwnership(path, owners)
+            else:
+                to_blame.append((path, blob_id))
+
+        for (path, blob_id, owners) in getexecutor().imap_unordered(
+                partial(getblame, rev=rev, cwd=self.dir), to_blame):
+            blame[getkey(path, blob_id)] = owners
+            self.addOwnership(path, owners)
+
+        for (path, blob_id) in previous["blobs"].items():
+            if blobs.get(path) != blob_id:
+                blame.pop(getkey(path, blob_id), None)
+        blame[repository] = {"head": rev, "blobs": blobs}
+
+    ##
+    # Paths changed between the commits `old` and `new`, every path if `old`
+    # is no longer known
+    def getChangedPaths(self, old, new):
+        try:
+            return set(
+                path.decode("utf-8", "replace")
+                for path in getpipeoutputstream(
+                    ["git", "diff", "--name-only", "--no-renames", "-z", old,
+                     new, "--"],
+                    separator=b"\0",
+                    cwd=self.dir) if len(path) > 0)
+        except subprocess.CalledProcessError:
+            return None
+
+    def addOwnership(self, path, owners):
+        ext = getextension(path)
+        if ext not in self.ownership_by_extension:
+            self.ownership_by_extension[ext] = {}
+        mergecounts(self.ownership_by_author, owners)
+        mergecounts(self.ownership_by_extension[ext], owners)
+
+    def collectTags(self):
+        asyncio.run(self.collectTagsAsync())
+
+    ##
+    # Collect the date of every tag with one `git for-each-ref` and the
+    # commits and authors of every tag with one walk over the tagged
+    # history. Each commit is assigned to the earliest tag containing it.
+    # Commits and authors are cached per tag and object id; a rerun only
+    # walks the history of tags added since, which cannot take commits of
+    # the earlier, cached tags. Tags removed, moved or added before cached
+    # ones have the whole tagged history walked again.
+    async def collectTagsAsync(self):
+        # outputs "<object> <date> <peeled date> <peeled object> <tag>",
+        # the peeled fields are only set for annotated tags
+        lines = getpipeoutputstreamasync([
+            "git", "for-each-ref",
+            "--format=%(objectname) %(authordate:unix) %(*authordate:unix) "
+            "%(*objectname) %(refname:strip=2)", "refs/tags"
+        ], cwd=self.dir)
+        tag_commits = {}  # tag -> commit
+        async for line in lines:
             if len(line) == 0:
                 continue
-
-            # <stamp> <author>
-            if re.search("files? changed", line) == None:
-                pos = line.find(" ")
-                if pos != -1:
-                    try:
-                        (stamp, author) = (int(line[:pos]), line[pos + 1:])
-                        self.changes_by_date[stamp] = {
-                            "files": files,
-                            "ins": inserted,
-                            "del": deleted,
-                            "lines": total_lines,
-                        }
-
-                        date = datetime.datetime.fromtimestamp(stamp)
-                        yymm = date.strftime("%Y-%m")
-                        self.lines_added_by_month[yymm] = (
-                            self.lines_added_by_month.get(yymm, 0) + inserted)
-                        self.lines_removed_by_month[yymm] = (
-                            self.lines_removed_by_month.get(yymm, 0) + deleted)
-
-                        yy = date.year
-                        self.lines_added_by_year[yy] = (
-                            self.lines_added_by_year.get(yy, 0) + inserted)
-                        self.lines_removed_by_year[yy] = (
-                            self.lines_removed_by_year.get(yy, 0) + deleted)
-
-                        files, inserted, deleted = 0, 0, 0
-                    except ValueError:
-                        print('Warning: unexpected line "%s"' % line)
-                else:
-                    print('Warning: unexpected line "%s"' % line)
+            (hash, stamp, peeled_stamp, peeled, tag) = line.decode(
+                "utf-8", "replace").split(" ", 4)
+            if len(peeled) > 0:
+                (stamp, commit) = (peeled_stamp, peeled)
             else:
-                numbers = getstatsummarycounts(line)
-
-                if len(numbers) == 3:
-                    (files, inserted, deleted) = map(lambda el: int(el),
-                                                     numbers)
-                    total_lines += inserted
-                    total_lines -= deleted
-                    self.total_lines_added += inserted
-                    self.total_lines_removed += deleted
-
-                else:
-                    print('Warning: failed to handle line "%s"' % line)
-                    (files, inserted, deleted) = (0, 0, 0)
-                # self.changes_by_date[stamp] = { 'files': files, 'ins': inserted, 'del': deleted }
-        self.total_lines += total_lines
-
-        # Per-author statistics
-
-        # defined for stamp, author only if author commited at this timestamp.
-        self.changes_by_date_by_author = {}  # stamp -> author -> lines_added
-
-        # Similar to the above, but never use --first-parent
-        # (we need to walk through every commit to know who
-        # committed what, not just through mainline)
-        lines = getpipeoutput([
-            'git log --shortstat --date-order --pretty=format:"%%at %%aN" %s' %
-            (getlogrange("HEAD"))
-        ]).split("\n")
-        lines.reverse()
-        files = 0
-        inserted = 0
-        deleted = 0
-        author = None
-        stamp = 0
-        for line in lines:
-            if len(line) == 0:
+                commit = hash
+            if len(stamp) == 0:
+                # not pointing to a commit
                 continue
-
-            # <stamp> <author>
-            if re.search("files? changed", line) == None:
-                pos = line.find(" ")
-                if pos != -1:
-                    try:
-                        oldstamp = stamp
-                        (stamp, author) = (int(line[:pos]), line[pos + 1:])
-                        if oldstamp > stamp:
-                            # clock skew, keep old timestamp to avoid having ugly graph
-                            stamp = oldstamp
-                        if author not in self.authors:
-                            self.authors[author] = {
-                                "lines_added": 0,
-                                "lines_removed": 0,
-                                "commits": 0,
-                            }
-                        self.authors[author]["commits"] = (
-                            self.authors[author].get("commits", 0) + 1)
-                        self.authors[author]["lines_added"] = (
-                            self.authors[author].get("lines_added", 0) +
-                            inserted)
-                        self.authors[author]["lines_removed"] = (
-                            self.authors[author].get("lines_removed", 0) +
-                            deleted)
-                        if stamp not in self.changes_by_date_by_author:
-                            self.changes_by_date_by_author[stamp] = {}
-                        if author not in self.changes_by_date_by_author[stamp]:
-                            self.changes_by_date_by_author[stamp][author] = {}
-                        self.changes_by_date_by_author[stamp][author][
-                            "lines_added"] = self.authors[author][
-                                "lines_added"]
-                        self.changes_by_date_by_author[stamp][author][
-                            "commits"] = self.authors[author]["commits"]
-                        files, inserted, deleted = 0, 0, 0
-                    except ValueError:
-                        print('Warning: unexpected line "%s"' % line)
-                else:
-                    print('Warning: unexpected line "%s"' % line)
+            stamp = int(stamp)
+            self.tags[tag] = {
+                "stamp": stamp,
+                "hash": hash,
+                "date": datetime.datetime.fromtimestamp(stamp).strftime(
+                    "%Y-%m-%d"),
+                "commits": 0,
+                "authors": {},
+            }
+            tag_commits[tag] = commit
+        repository = os.path.abspath(self.dir)
+        cached = self.cache["tags"].get(repository, {})  # tag -> tags entry
+
+        def order(tag):
+            return (self.tags[tag]["date"], tag)
+
+        tags = sorted(self.tags, key=order)
+        new = [tag for tag in tags
+               if cached.get(tag, {}).get("hash") != self.tags[tag]["hash"]]
+        old = [tag for tag in tags if tag not in new]
+        if len(old) < len(cached) or (len(old) > 0 and len(new) > 0
+                                      and order(new[0]) < order(old[-1])):
+            (old, new) = ([], tags)
+        for tag in old:
+            self.tags[tag]["commits"] = cached[tag]["commits"]
+            self.tags[tag]["authors"] = dict(cached[tag]["authors"])
+        if len(new) > 0:
+            await self.walkTags(tag_commits, new, old)
+        self.cache["tags"][repository] = dict(
+            (tag, dict(info, authors=dict(info["authors"])))
+            for (tag, info) in self.tags.items())
+
+    ##
+    # Assign the commits of the tags `new`, not reachable from the tags
+    # `old`, to the earliest of the tags `new` containing them
+    async def walkTags(self, tag_commits, new, old):
+        # outputs "<commit>\0<parents>\0<author>" for each tagged commit
+        commits = {}  # commit -> (parents, author)
+        async for line in getpipeoutputstreamasync(
+            ["git", "log", "--pretty=format:%x00%H%x00%P%x00%aN"] +
+            [tag_commits[tag] for tag in new] + ["--not"] +
+            [tag_commits[tag] for tag in old] + ["--"],
+                cwd=self.dir):
+            if len(line) == 0 or line[0:1] != b"\0":
+                continue
+            (commit, parents, author) = line[1:].decode("utf-8",
+                                                       "replace").split("\0")
+            commits[commit] = (parents.split(), author)
+
+        # tags from the oldest, every commit not contained in an older tag
+        # belongs to this one
+        seen = set()
+        for tag in new:
+            authors = self.tags[tag]["authors"]
+            pending = [tag_commits[tag]]
+            while len(pending) > 0:
+                commit = pending.pop()
+                if commit in seen or commit not in commits:
+                    continue
+                seen.add(commit)
+                (parents, author) = commits[commit]
+                authors[author] = authors.get(author, 0) + 1
+                self.tags[tag]["commits"] += 1
+                pending.extend(parents)
+
+    ##
+    # The commit the report is collected up to (conf["commit_end"])
+    def getHead(self):
+        rev = getcommitrange("HEAD", end_only=True)
+        head = None
+        if self.getObjects() is not None:
+            head = self.objects.resolve(rev)
+        if head is None:
+            head = getpipeoutput(["git", "rev-parse", rev], cwd=self.dir)
+        return head
+
+    ##
+    # Collect the history aggregates of the repository in `dir` into a new
+    # collector. The aggregates are cached together with the head they were
+    # collected up to, so that a rerun only walks the commits added since.
+    # Falls back to walking the whole history if that head is no longer on
+    # the first-parent chain of the current head (e.g. history rewritten).
+    def collectHistory(self, dir):
+        key = "%s|%s|%s|%d" % (os.path.abspath(dir), conf["commit_end"],
+                               conf["start_date"], conf["linear_linestats"])
+        aggregators = sorted(aggregator.name
+                             for aggregator in self.getAggregators())
+        if len(conf["metrics"]) > 0:
+            # collected with only some of the aggregators
+            key += "|" + ",".join(aggregators)
+        entry = self.cache["history"].get(key)
+        if entry is not None and (
+                entry.get("version") != self.history_version
+                or set(entry["state"]) != set(self.history_fields)):
+            # collected by a version with other aggregates
+            entry = None
+        head = self.getHead()
+
+        if entry is not None and entry["head"] == head:
+            part = self.newPart()
+            part.setHistoryState(entry["state"])
+        elif entry is not None and self.isFirstParentAncestor(
+                entry["head"], head):
+            print("Collecting commits since %s..." % entry["head"])
+            part = self.newPart()
+            part.setHistoryState(entry["state"])
+            part.mergeHistory(
+                [self.collectRange(head, exclude=entry["head"])])
+        else:
+            part = self.collectRange(head)
+        self.cache["history"][key] = {
+            "head": head,
+            "version": self.history_version,
+            "state": part.getHistoryState()
+        }
+        part.history_keys = [key]
+        return part
+
+    ##
+    # Collect the history aggregates of the commits reachable from `head`
+    # but not from `exclude` into a new collector. With
+    # conf["history_shards"] > 1 the first-parent chain is cut into that many
+    # ranges b1..b0, b2..b1, ... which are walked in parallel processes and
+    # merged oldest first (see mergeHistory()).
+    def collectRange(self, head, exclude=None):
+        shards = conf["history_shards"]
+        boundaries = []
+        if shards > 1:
+            # outputs the mainline, newest first
+            mainline = getpipeoutput(
+                ["git", "rev-list", "--first-parent"] +
+                getlogrange(head=head, exclude=exclude) + ["--"],
+                cwd=self.dir).split()
+            boundaries = mainline[::max(-(-len(mainline) // shards), 1)]
+        if len(boundaries) <= 1:
+            part = self.newPart()
+            part.walkHistory(part.getAggregators(),
+                             getlogrange(head=head, exclude=exclude))
+            return part
+
+        excludes = boundaries[1:] + [exclude]
+        logranges = [
+            getlogrange(head=b, exclude=e)
+            for (b, e) in zip(boundaries, excludes)
+        ]
+        logranges.reverse()
+
+        # spawned, as the walk runs in a thread next to the other phases
+        part = self.newPart()
+        with ProcessPoolExecutor(
+                max_workers=len(logranges),
+                mp_context=get_context("spawn")) as executor:
+            results = executor.map(collectrange, repeat(self.dir),
+                                   repeat(self.cache.path), repeat(dict(conf)),
+                                   logranges)
+
+            def shards():
+                for (shard, entries, spans) in results:
+                    tracing.extend(spans)
+                    self.cache.update(entries)
+                    yield shard
+
+            part.mergeHistory(shards())
+        return part
+
+    ##
+    # Fold `others`, collectors of later parts of the history of this
+    # repository, into this one, oldest first. Unlike merge(), which
+    # continues the aggregates depending on the order of the walk, these
+    # are computed again from the merged commit graph (see reorder()), so
+    # the result is that of a single walk however the history was split.
+    def mergeHistory(self, others):
+        for other in others:
+            self.merge(other)
+            self.commit_graph.merge(
+                other.commit_graph,
+                [self.authors.ids[name] for name in other.authors.names])
+        self.reorder()
+
+    ##
+    # Compute the aggregates that depend on the order of the walk from the
+    # commit graph, in the order of a single walk over all of its commits:
+    # changes_by_date_by_author, the last active days and, without
+    # conf["linear_linestats"], changes_by_date
+    def reorder(self):
+        graph = self.commit_graph
+        if len(graph) == 0:
+            return
+        phases = getphases()
+        if "author_stats" in phases:
+            self.changes_by_date_by_author = graph.getauthorchanges()
+        if "line_stats" in phases and not conf["linear_linestats"]:
+            self.changes_by_date = graph.getlinechanges()
+        if "activity" in phases:
+            (last, authors) = graph.getlastrows()
+            self.last_active_day = datetime.datetime.fromtimestamp(
+                graph.stamps[last]).strftime("%Y-%m-%d")
+            for (author, row) in authors.items():
+                self.authors.infos[author].last_active_day = (
+                    datetime.date.fromtimestamp(graph.stamps[row]).toordinal())
+
+    ##
+    # A collector for a part of the history of this repository
+    def newPart(self):
+        part = GitDataCollector()
+        part.dir = self.dir
+        part.cache = self.cache
+        part.objects = self.objects
+        return part
+
+    ##
+    # Is `rev` the first parent of the oldest first-parent commit of rev..head?
+    # False as well if `rev` is gone from the repository.
+    def isFirstParentAncestor(self, rev, head):
+        if self.getObjects() is not None:
+            return rev in self.objects.iterfirstparents(head)
+        try:
+            lines = getpipeoutput(
+                ["git", "rev-list", "--first-parent", "--parents",
+                 "%s..%s" % (rev, head), "--"],
+                cwd=self.dir).split("\n")
+        except subprocess.CalledProcessError:
+            return False
+        return lines[-1].split(" ")[1:2] == [rev]
+
+    ##
+    # Aggregators fed by the history walk that the requested metrics need,
+    # see common.aggregators and common.metrics
+    def getAggregators(self):
+        phases = getphases()
+        aggregators = []
+        if "activity" in phases:
+            if numpy is not None and conf["columnar_activity"]:
+                aggregators.append(ColumnarActivityAggregator(self))
             else:
-                numbers = getstatsummarycounts(line)
-
-                if len(numbers) == 3:
-                    (files, inserted, deleted) = map(lambda el: int(el),
-                                                     numbers)
-                else:
-                    print('Warning: failed to handle line "%s"' % line)
-                    (files, inserted, deleted) = (0, 0, 0)
+                aggregators += [
+                    ActivityAggregator(self),
+                    AuthorsAggregator(self),
+                    DomainsAggregator(self),
+                    TimezoneAggregator(self),
+                ]
+        return aggregators + [
+            aggregator(self) for aggregator in (
+                FilesAggregator,
+                LineStatsAggregator,
+                AuthorStatsAggregator,
+                ChurnAggregator,
+                CommitSeriesAggregator,
+                CommitGraphAggregator,
+            ) if aggregator.name in phases
+        ]
+
+    ##
+    # Read every commit of the range once and pass it to all aggregators.
+    # The diff of every commit is only read if one of them needs it. The
+    # time spent in each aggregator is summed up over all commits and
+    # recorded as a phase named after the aggregator, together with its
+    # finish(). The aggregates depending on the order of the walk are
+    # computed last, see reorder().
+    def walkHistory(self, aggregators, logrange):
+        options = LOG_OPTIONS
+        if "numstat" in getphases():
+            options = options + NUMSTAT_OPTIONS
+        lines = getpipeoutputstream(["git", "log"] + options +
+                                    ["--pretty=format:" + LOG_FORMAT] +
+                                    logrange + ["--"],
+                                    separator=b"\0",
+                                    cwd=self.dir)
+        elapsed = [0.0] * len(aggregators)
+        clock = time.perf_counter
+        with tracing.span("walk", logrange=" ".join(logrange)):
+            for commit in parsecommits(lines):
+                for (i, aggregator) in enumerate(aggregators):
+                    start = clock()
+                    aggregator.process(commit)
+                    elapsed[i] += clock() - start
+        for (i, aggregator) in enumerate(aggregators):
+            tracing.record(aggregator.name, elapsed[i])
+            with tracing.span(aggregator.name):
+                aggregator.finish()
+        with tracing.span("reorder"):
+            self.reorder()
 
     def refine(self):
-        # authors
-        # name -> {place_by_commits, commits_frac, date_first, date_last, timedelta}
-        self.authors_by_commits = getkeyssortedbyvaluekey(
-            self.authors, "commits")
-        self.authors_by_commits.reverse()  # most first
-        for i, name in enumerate(self.authors_by_commits):
-            self.authors[name]["place_by_commits"] = i + 1
-
-        for name in self.authors.keys():
-            a = self.authors[name]
-            a["commits_frac"] = (100 *
-                                 float(a["commits"])) / self.getTotalCommits()
-            date_first = datetime.datetime.fromtimestamp(
-                a["first_commit_stamp"])
-            date_last = datetime.datetime.fromtimestamp(a["last_commit_stamp"])
-            delta = date_last - date_first
-            a["date_first"] = date_first.strftime("%Y-%m-%d")
-            a["date_last"] = date_last.strftime("%Y-%m-%d")
-            a["timedelta"] = delta
-            if "lines_added" not in a:
-                a["lines_added"] = 0
-            if "lines_removed" not in a:
-                a["lines_removed"] = 0
+        with tracing.span("refine"):
+            # authors, expanded to names for the report
+            # name -> {place_by_commits, commits_frac, date_first, date_last, timedelta}
+            self.author_info = dict(
+                (self.authors.getname(id), info.todict())
+                for (id, info) in enumerate(self.authors.infos))
+            self.authors_by_commits = getkeyssortedbyvaluekey(
+                self.author_info, "commits")
+            self.authors_by_commits.reverse()  # most first
+            for i, name in enumerate(self.authors_by_commits):
+                self.author_info[name]["place_by_commits"] = i + 1
+
+            for name in self.author_info.keys():
+                a = self.author_info[name]
+                if "first_commit_stamp" not in a:
+                    # activity not collected (see common.metrics)
+                    continue
+                a["commits_frac"] = (
+                    100 * float(a["commits"])) / self.getTotalCommits()
+                date_first = datetime.datetime.fromtimestamp(
+                    a["first_commit_stamp"])
+                date_last = datetime.datetime.fromtimestamp(
+                    a["last_commit_stamp"])
+                delta = date_last - date_first
+                a["date_first"] = date_first.strftime("%Y-%m-%d")
+                a["date_last"] = date_last.strftime("%Y-%m-%d")
+                a["timedelta"] = delta
+                if "lines_added" not in a:
+                    a["lines_added"] = 0
+                if "lines_removed" not in a:
+                    a["lines_removed"] = 0
 
     def getActiveDays(self):
         return self.active_days
@@ -480,10 +599,10 @@ class GitDataCollector(DataCollector):
         return self.activity_by_hour_of_day
 
     def getAuthorInfo(self, author):
-        return self.authors[author]
+        return self.author_info[author]
 
     def getAuthors(self, limit=None):
-        res = getkeyssortedbyvaluekey(self.authors, "commits")
+        res = getkeyssortedbyvaluekey(self.author_info, "commits")
         res.reverse()
         return res[:limit]
 
@@ -504,11 +623,10 @@ class GitDataCollector(DataCollector):
         return datetime.datetime.fromtimestamp(self.last_commit_stamp)
 
     def getTags(self):
-        lines = getpipeoutput(["git show-ref --tags", "cut -d/ -f3"])
-        return lines.split("\n")
+        return list(self.tags.keys())
 
     def getTagDate(self, tag):
-        return self.revToDate("tags/" + tag)
+        return self.tags[tag]["date"]
 
     def getTotalAuthors(self):
         return self.total_authors
@@ -527,25 +645,69 @@ class GitDataCollector(DataCollector):
 
     def revToDate(self, rev):
         stamp = int(
-            getpipeoutput(['git log --pretty=format:%%at "%s" -n 1' % rev]))
+            getpipeoutput(
+                ["git", "log", "--pretty=format:%at", "-n", "1", rev, "--"],
+                cwd=self.dir))
         return datetime.datetime.fromtimestamp(stamp).strftime("%Y-%m-%d")
 
-    def dumpJson(self):
-        authorInfo = {}
-
-        for name, active in self.authors.items():
-            tmp = {}
-            for k, v in active.items():
-                if isinstance(v, set):
-                    tmp[k] = list(v)
-                elif isinstance(v, datetime.timedelta):
-                    tmp[k] = str(v)
-                else:
-                    tmp[k] = v
-            authorInfo[name] = tmp
-
-        print(self.authors_by_commits)
-        
+    ##
+    # {key: {name: value}} of {key: {author id: value}}
+    def expandAuthors(self, values):
+        return dict((key, self.authors.expand(authors))
+                    for (key, authors) in values.items())
+
+    ##
+    # changes_by_date_by_author for the report, as conf["author_changes"]
+    # says: "nested" as stamp -> author -> {lines_added, commits}, "sparse"
+    # as columns of one row per stamp and author (see AuthorChanges.tosparse)
+    def getAuthorChanges(self):
+        if conf["author_changes"] == "sparse":
+            return self.changes_by_date_by_author.tosparse(self.authors.names)
+        if conf["author_changes"] != "nested":
+            raise ValueError('no such author_changes format "%s"' %
+                             conf["author_changes"])
+        return self.changes_by_date_by_author.todict(self.authors.names)
+
+    ##
+    # Write the per-commit series (changes_by_date, changes_by_date_by_author)
+    # to `outputpath` as columnar files in `format` (see
+    # common.columnar.SERIES_FORMATS), one row per commit and per author and
+    # commit, sorted by stamp. Returns {section: file name}.
+    def dumpSeries(self, outputpath, format):
+        if format not in SERIES_FORMATS:
+            raise ValueError('no such series format "%s"' % format)
+        (ext, write) = SERIES_FORMATS[format]
+        stamps = sorted(self.changes_by_date)
+        changes = self.changes_by_date_by_author.tosparse(self.authors.names)
+        series = {
+            "changes_by_date": {
+                "stamp": stamps,
+                "files": [self.changes_by_date[s]["files"] for s in stamps],
+                "ins": [self.changes_by_date[s]["ins"] for s in stamps],
+                "del": [self.changes_by_date[s]["del"] for s in stamps],
+                "lines": [self.changes_by_date[s]["lines"] for s in stamps],
+            },
+            "changes_by_date_by_author": {
+                "stamp": changes["stamp"],
+                "author": [changes["authors"][i] for i in changes["author"]],
+                "lines_added": changes["lines_added"],
+                "commits": changes["commits"],
+            },
+        }
+
+        files = {}
+        for section, columns in series.items():
+            files[section] = "%s.%s" % (section, ext)
+            with tracing.span("series", file=files[section]):
+                write(os.path.join(outputpath, files[section]), columns)
+        return files
+
+    ##
+    # Write the report as JSON to the binary file `f`, one section at a time.
+    # With `series` ({section: file name} as returned by dumpSeries) the
+    # per-commit series are referenced instead of included. The "timings"
+    # section (see common.tracing) comes last, so it includes the dump.
+    def dumpJson(self, f, series=None, indent=0):
         data = {
             'stamp_created': self.stamp_created,
             'total_authors': self.total_authors,
@@ -558,13 +720,15 @@ class GitDataCollector(DataCollector):
             'activity_by_hour_of_week_busiest':
             self.activity_by_hour_of_week_busiest,
             'activity_by_year_week': self.activity_by_year_week,
-            'authors': authorInfo,
+            'authors': self.author_info,
             'total_commits': self.total_commits,
             'total_files': self.total_files,
             'authors_by_commits': self.authors_by_commits,
             'domains': self.domains,
-            'author_of_month': self.author_of_month,
-            'author_of_year': self.author_of_year,
+            'author_of_month':
+            lambda: self.expandAuthors(self.author_of_month),
+            'author_of_year':
+            lambda: self.expandAuthors(self.author_of_year),
             'commits_by_month': self.commits_by_month,
             'commits_by_year': self.commits_by_year,
             'lines_added_by_month': self.lines_added_by_month,
@@ -574,7 +738,7 @@ class GitDataCollector(DataCollector):
             'first_commit_stamp': self.first_commit_stamp,
             'last_commit_stamp': self.last_commit_stamp,
             'last_active_day': self.last_active_day,
-            'active_days': list(self.active_days),
+            'active_days': self.active_days,
             'total_lines': self.total_lines,
             'total_lines_added': self.total_lines_added,
             'total_lines_removed': self.total_lines_removed,
@@ -583,8 +747,82 @@ class GitDataCollector(DataCollector):
             'tags': self.tags,
             'files_by_stamp': self.files_by_stamp,
             'extensions': self.extensions,
+            'ownership_by_author': self.ownership_by_author,
+            'ownership_by_extension': self.ownership_by_extension,
+            'churn': lambda: {
+                'files': self.churn.top(conf["churn_top"]),
+                'directories': self.churn.top(conf["churn_top"], files=False),
+            },
             'changes_by_date': self.changes_by_date,
-            'changes_by_date_by_author': self.changes_by_date_by_author
+            'changes_by_date_by_author': self.getAuthorChanges,
         }
-        
-        return json.dumps(data, indent=4)
\ No newline at end of file
+        # only the requested metrics (see common.metrics)
+        sections = getsections()
+        for section in list(data):
+            if section != 'stamp_created' and section not in sections:
+                del data[section]
+        if series:
+            for section in series:
+                data.pop(section, None)
+            data['series'] = series
+
+        # per-period windows of the commit series, e.g. "week,month,quarter"
+        if len(conf["rollups"]) > 0 and "rollups" in sections:
+            with tracing.span("rollups"):
+                index = RangeIndex(self.commit_series, self.files_by_stamp)
+                data['rollups'] = dict(
+                    (period, index.rollup(period))
+                    for period in conf["rollups"].split(","))
+
+        writer = JsonWriter(f, indent)
+        with tracing.span("json"):
+            for section, value in data.items():
+                # sections keyed by author id are expanded one at a time
+                if callable(value):
+                    value = value()
+                writer.write(section, value)
+        writer.write('timings', tracing.gettimings())
+        writer.close()
+
+
+##
+# Collect the repository at `gitpath` in a worker process. Returns the
+# collector, without its cache, the cache entries added while collecting and
+# the spans recorded (see common.tracing).
+def collectrepository(gitpath, cachefile, config):
+    conf.update(config)
+    tracing.drain()
+    data = GitDataCollector()
+    data.loadCache(cachefile)
+    try:
+        data.collect(gitpath)
+    finally:
+        # the worker process may be handed another repository
+        closeexecutor()
+    entries = data.cache.pending()
+    data.cache.close()
+    data.cache = None
+    data.objects = None
+    return (data, entries, tracing.drain())
+
+
+##
+# Walk `logrange` of the repository at `gitpath` in a worker process. Returns
+# the collector, without its cache, the cache entries added while walking and
+# the spans recorded.
+def collectrange(gitpath, cachefile, config, logrange):
+    conf.update(config)
+    tracing.drain()
+    data = GitDataCollector()
+    data.dir = gitpath
+    if cachefile is not None:
+        data.cache.open(cachefile)
+    try:
+        data.walkHistory(data.getAggregators(), logrange)
+    finally:
+        closeexecutor()
+    entries = data.cache.pending()
+    data.cache.close()
+    data.cache = None
+    data.objects = None
+    return (data, entries, tracing.drain())
@@ -0,0 +1,67 @@
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonWriter:
+    """
+    Writes a JSON object to a binary file one member at a time, so that only
+    a single member is encoded in memory at once.
+    """
+    def __init__(self, f, indent=0):
+        self.f = f
+        self.indent = indent
+        self.members = 0
+        f.write(b"{")
+
+    def write(self, key, value):
+        if self.members > 0:
+            self.f.write(b",")
+        key = encodejson(str(key))
+        value = encodejson(value, self.indent)
+        if self.indent > 0:
+            padding = b"\n" + b" " * self.indent
+            self.f.write(padding + key + b": " +
+                         value.replace(b"\n", padding))
+        else:
+            self.f.write(key + b":" + value)
+        self.members += 1
+
+    def close(self):
+        if self.indent > 0 and self.members > 0:
+            self.f.write(b"\n")
+        self.f.write(b"}")
+
+
+##
+# Encode `value` as UTF-8 JSON, with orjson if it is installed (compact or
+# indented by 2) and the json module otherwise
+def encodejson(value, indent=0):
+    if orjson is not None and indent in (0, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent > 0:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, default=encodeextra, option=option)
+    if indent > 0:
+        return json.dumps(value,
+                          default=encodeextra,
+                          ensure_ascii=False,
+                          indent=indent).encode()
+    return json.dumps(value,
+                      default=encodeextra,
+                      ensure_ascii=False,
+                      separators=(",", ":")).encode()
+
+
+##
+# Values json cannot encode: sets as sorted lists, timedeltas as strings
+def encodeextra(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    raise TypeError("cannot encode %s as JSON" % type(value).__name__)
@@ -0,0 +1,470 @@
+import glob
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from collections import OrderedDict
+
+# object types in packfiles
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+TYPE_NAMES = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob",
+              OBJ_TAG: "tag"}
+
+HEX_ID = re.compile(r"^[0-9a-f]{40}$")
+
+
+class ObjectDatabase:
+    """
+    Reads refs and objects straight from the .git directory of a repository
+    instead of asking git: loose objects, packfiles through their .idx (both
+    mapped with mmap) and delta chains. Decoded objects are kept in a cache
+    of at most `cachesize` bytes, and file counts of trees are remembered,
+    so that phases sharing the database don't decode the same objects
+    twice. Raises ValueError for repositories it cannot read (e.g. SHA-256
+    object format).
+    """
+    def __init__(self, dir, cachesize=64 << 20):
+        (self.gitdir, self.commondir) = findgitdir(dir)
+        config = os.path.join(self.commondir, "config")
+        if os.path.exists(config):
+            with open(config) as f:
+                if re.search(r"objectformat\s*=\s*sha256", f.read(), re.I):
+                    raise ValueError("SHA-256 repositories are not supported")
+        self.objectdirs = [os.path.join(self.commondir, "objects")]
+        alternates = os.path.join(self.objectdirs[0], "info", "alternates")
+        if os.path.exists(alternates):
+            with open(alternates) as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) > 0 and not line.startswith("#"):
+                        self.objectdirs.append(
+                            os.path.join(self.objectdirs[0], line))
+        self.packs = [
+            Pack(path[:-4]) for objectdir in self.objectdirs
+            for path in sorted(
+                glob.glob(os.path.join(objectdir, "pack", "*.idx")))
+        ]
+        self.packedrefs = None
+        self.cache = OrderedDict()  # key -> (type, data)
+        self.cachesize = cachesize
+        self.cached = 0
+        self.files_in_tree = {}  # tree -> number of files
+        self.lock = threading.Lock()
+
+    def close(self):
+        for pack in self.packs:
+            pack.close()
+        self.packs = []
+
+    ##
+    # Object id of a ref name, full object id, "HEAD" or a branch, tag or
+    # remote name, None for anything else (revision expressions, unknown
+    # names)
+    def resolve(self, name):
+        if HEX_ID.match(name):
+            return name if self.contains(name) else None
+        for ref in (name, "refs/" + name, "refs/tags/" + name,
+                    "refs/heads/" + name, "refs/remotes/" + name,
+                    "refs/remotes/%s/HEAD" % name):
+            if ref != "HEAD" and not ref.startswith("refs/"):
+                continue
+            sha = self.readref(ref)
+            if sha is not None:
+                return sha
+        return None
+
+    def readref(self, ref, depth=0):
+        for dir in (self.gitdir, self.commondir):
+            path = os.path.join(dir, ref)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    value = f.read().strip()
+                if value.startswith("ref: ") and depth < 5:
+                    return self.readref(value[5:], depth + 1)
+                return value if HEX_ID.match(value) else None
+        return self.getpackedrefs().get(ref)
+
+    def getpackedrefs(self):
+        if self.packedrefs is None:
+            self.packedrefs = {}
+            path = os.path.join(self.commondir, "packed-refs")
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        if line.startswith("#") or line.startswith("^"):
+                            continue
+                        (sha, ref) = line.rstrip("\n").split(" ", 1)
+                        self.packedrefs[ref] = sha
+        return self.packedrefs
+
+    def contains(self, sha):
+        if self.findloose(sha) is not None:
+            return True
+        binsha = bytes.fromhex(sha)
+        return any(pack.find(binsha) is not None for pack in self.packs)
+
+    def findloose(self, sha):
+        for objectdir in self.objectdirs:
+            path = os.path.join(objectdir, sha[0:2], sha[2:])
+            if os.path.exists(path):
+                return path
+        return None
+
+    ##
+    # (type name, contents) of the object `sha`, kept in the cache unless
+    # `cache` is false (e.g. blobs read only once)
+    def read(self, sha, cache=True):
+        with self.lock:
+            if sha in self.cache:
+                self.cache.move_to_end(sha)
+                return self.cache[sha]
+        path = self.findloose(sha)
+        if path is not None:
+            with open(path, "rb") as f:
+                raw = zlib.decompress(f.read())
+            nul = raw.index(b"\0")
+            obj = (raw[0:nul].split(b" ")[0].decode(), raw[nul + 1:])
+        else:
+            obj = self.readpacked(bytes.fromhex(sha))
+        if cache:
+            self.store(sha, obj)
+        return obj
+
+    ##
+    # Size of the contents of the object `sha`, without decoding all of it
+    def size(self, sha):
+        path = self.findloose(sha)
+        if path is not None:
+            with open(path, "rb") as f:
+                header = zlib.decompressobj().decompress(f.read(256), 64)
+            return int(header[0:header.index(b"\0")].split(b" ")[1])
+        binsha = bytes.fromhex(sha)
+        for pack in self.packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack.size(offset)
+        raise KeyError(sha)
+
+    def store(self, key, obj):
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key] = obj
+            self.cached += len(obj[1])
+            while self.cached > self.cachesize and len(self.cache) > 1:
+                (_, old) = self.cache.popitem(last=False)
+                self.cached -= len(old[1])
+
+    def readpacked(self, binsha):
+        for pack in self.packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return self.readat(pack, offset)
+        raise KeyError(binsha.hex())
+
+    ##
+    # Object at `offset` of `pack`, resolving its delta chain
+    def readat(self, pack, offset):
+        deltas = []
+        while True:
+            key = (pack.path, offset)
+            with self.lock:
+                cached = self.cache.get(key)
+            if cached is not None:
+                (type, data) = cached
+                break
+            (type, data, base) = pack.readentry(offset)
+            if type == OBJ_OFS_DELTA:
+                deltas.append((key, data))
+                offset = base
+            elif type == OBJ_REF_DELTA:
+                deltas.append((key, data))
+                (type, data) = self.read(base.hex())
+                break
+            else:
+                type = TYPE_NAMES[type]
+                if len(deltas) > 0:
+                    self.store(key, (type, data))
+                break
+        for (key, delta) in reversed(deltas):
+            data = applydelta(data, delta)
+            # delta bases are shared by many objects
+            self.store(key, (type, data))
+        return (type, data)
+
+    ##
+    # Object id of the tree of the commit or tag `sha`, or `sha` itself
+    def gettree(self, sha):
+        (type, data) = self.read(sha)
+        while type == "tag":
+            sha = data[7:47].decode()  # "object <id>\n"
+            (type, data) = self.read(sha)
+        if type == "commit":
+            return data[5:45].decode()  # "tree <id>\n"
+        return sha
+
+    ##
+    # (mode, name, object id) of the entries of the tree `sha`
+    def itertree(self, sha):
+        data = self.read(sha)[1]
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            yield (data[pos:space].decode(), data[space + 1:nul],
+                   data[nul + 1:nul + 21].hex())
+            pos = nul + 21
+
+    ##
+    # Yield (mode, object id, path) for every file of the tree of `treeish`
+    # and its subtrees, like `git ls-tree -r`
+    def iterfiles(self, treeish, prefix=b""):
+        for (mode, name, sha) in self.itertree(self.gettree(treeish)):
+            if mode == "40000":
+                yield from self.iterfiles(sha, prefix + name + b"/")
+            else:
+                yield (mode.rjust(6, "0"), sha, prefix + name)
+
+    ##
+    # Number of files of the tree of `treeish`, like
+    # `git ls-tree -r --name-only <treeish> | wc -l`
+    def countfiles(self, treeish):
+        tree = self.gettree(treeish)
+        count = self.files_in_tree.get(tree)
+        if count is None:
+            count = 0
+            for (mode, _, sha) in self.itertree(tree):
+                count += self.countfiles(sha) if mode == "40000" else 1
+            self.files_in_tree[tree] = count
+        return count
+
+    ##
+    # {"tree": id, "parents": [ids], "author": line, "committer": line} of
+    # the commit `sha`
+    def readcommit(self, sha):
+        data = self.read(sha)[1]
+        commit = {"parents": []}
+        for line in data[0:data.find(b"\n\n")].decode(
+                "utf-8", "replace").split("\n"):
+            (key, _, value) = line.partition(" ")
+            if key == "parent":
+                commit["parents"].append(value)
+            elif key in ("tree", "author", "committer"):
+                commit[key] = value
+        return commit
+
+    ##
+    # Yield the ids of `sha` and its first parents, newest first
+    def iterfirstparents(self, sha):
+        while sha is not None:
+            yield sha
+            parents = self.readcommit(sha)["parents"]
+            sha = parents[0] if len(parents) > 0 else None
+
+
+class Pack:
+    """A packfile and its .idx (version 1 or 2), both mapped into memory."""
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path + ".pack", "rb") as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx[0:4] == b"\377tOc":
+            self.version = struct.unpack(">I", self.idx[4:8])[0]
+            fanout = 8
+        else:
+            self.version = 1
+            fanout = 0
+        if self.version not in (1, 2):
+            raise ValueError("unsupported pack index version %d" %
+                             self.version)
+        self.fanout = struct.unpack(">256I",
+                                    self.idx[fanout:fanout + 1024])
+        self.count = self.fanout[255]
+        self.names = fanout + 1024
+
+    def close(self):
+        self.idx.close()
+        self.pack.close()
+
+    def getname(self, i):
+        if self.version == 1:
+            pos = self.names + i * 24 + 4
+        else:
+            pos = self.names + i * 20
+        return self.idx[pos:pos + 20]
+
+    ##
+    # Offset of the object `binsha` in the pack, None if it isn't in it
+    def find(self, binsha):
+        first = binsha[0]
+        lo = self.fanout[first - 1] if first > 0 else 0
+        hi = self.fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self.getname(mid)
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return self.getoffset(mid)
+        return None
+
+    def getoffset(self, i):
+        if self.version == 1:
+            pos = self.names + i * 24
+            return struct.unpack(">I", self.idx[pos:pos + 4])[0]
+        pos = self.names + self.count * 24 + i * 4
+        offset = struct.unpack(">I", self.idx[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = (self.names + self.count * 28 +
+                   (offset & 0x7fffffff) * 8)
+            offset = struct.unpack(">Q", self.idx[pos:pos + 8])[0]
+        return offset
+
+    ##
+    # (type, size, position of the data or delta base) of the entry at
+    # `offset`
+    def readheader(self, offset):
+        pack = self.pack
+        c = pack[offset]
+        type = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        pos = offset + 1
+        while c & 0x80:
+            c = pack[pos]
+            size |= (c & 0x7f) << shift
+            shift += 7
+            pos += 1
+        return (type, size, pos)
+
+    ##
+    # (type, data, delta base) of the entry at `offset`; the base is an
+    # offset for OBJ_OFS_DELTA, an object id for OBJ_REF_DELTA
+    def readentry(self, offset):
+        (type, size, pos) = self.readheader(offset)
+        base = None
+        if type == OBJ_OFS_DELTA:
+            c = self.pack[pos]
+            distance = c & 0x7f
+            pos += 1
+            while c & 0x80:
+                c = self.pack[pos]
+                distance = ((distance + 1) << 7) | (c & 0x7f)
+                pos += 1
+            base = offset - distance
+        elif type == OBJ_REF_DELTA:
+            base = self.pack[pos:pos + 20]
+            pos += 20
+        return (type, self.inflate(pos, size), base)
+
+    def inflate(self, pos, size, chunksize=1 << 16):
+        d = zlib.decompressobj()
+        out = []
+        while not d.eof:
+            chunk = self.pack[pos:pos + chunksize]
+            if not chunk:
+                raise ValueError("truncated pack %s" % self.path)
+            out.append(d.decompress(chunk))
+            pos += chunksize
+        return b"".join(out)
+
+    ##
+    # Size of the object at `offset`, read from its delta header for deltas
+    def size(self, offset):
+        (type, size, pos) = self.readheader(offset)
+        if type not in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            return size
+        if type == OBJ_OFS_DELTA:
+            while self.pack[pos] & 0x80:
+                pos += 1
+            pos += 1
+        else:
+            pos += 20
+        header = zlib.decompressobj().decompress(self.pack[pos:pos + 256], 32)
+        (_, pos) = readvarint(header, 0)  # size of the base
+        return readvarint(header, pos)[0]
+
+
+def readvarint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        c = data[pos]
+        pos += 1
+        value |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return (value, pos)
+
+
+##
+# Rebuild an object from its delta base and the delta instructions
+def applydelta(base, delta):
+    (_, pos) = readvarint(delta, 0)
+    (size, pos) = readvarint(delta, pos)
+    out = bytearray()
+    while pos < len(delta):
+        c = delta[pos]
+        pos += 1
+        if c & 0x80:
+            # copy from the base
+            offset = 0
+            length = 0
+            for i in range(4):
+                if c & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if c & (0x10 << i):
+                    length |= delta[pos] << (8 * i)
+                    pos += 1
+            if length == 0:
+                length = 0x10000
+            out += base[offset:offset + length]
+        elif c > 0:
+            # insert new data
+            out += delta[pos:pos + c]
+            pos += c
+        else:
+            raise ValueError("invalid delta instruction")
+    if len(out) != size:
+        raise ValueError("delta result has the wrong size")
+    return bytes(out)
+
+
+##
+# (git directory, common directory) of the repository at `dir`: its .git
+# directory, the directory a .git file points to (worktrees, submodules), or
+# `dir` itself for bare repositories
+def findgitdir(dir):
+    dotgit = os.path.join(dir, ".git")
+    if os.path.isdir(dotgit):
+        gitdir = dotgit
+    elif os.path.isfile(dotgit):
+        with open(dotgit) as f:
+            line = f.read().strip()
+        if not line.startswith("gitdir: "):
+            raise ValueError("cannot read %s" % dotgit)
+        gitdir = os.path.join(dir, line[8:])
+    elif os.path.isdir(os.path.join(dir, "objects")) and os.path.isfile(
+            os.path.join(dir, "HEAD")):
+        gitdir = dir
+    else:
+        raise ValueError("%s is not the top of a git repository" % dir)
+    commondir = gitdir
+    if os.path.isfile(os.path.join(gitdir, "commondir")):
+        with open(os.path.join(gitdir, "commondir")) as f:
+            commondir = os.path.join(gitdir, f.read().strip())
+    return (os.path.normpath(gitdir), os.path.normpath(commondir))
@@ -0,0 +1,430 @@
+import datetime
+import os
+import sys
+import time
+
+from array import array
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .CacheStore import CacheStore
+from .CommitSeries import CommitSeries
+from .JsonWriter import encodejson
+from .RangeIndex import RangeIndex
+from .constans import WEEKDAYS
+
+# columns a query can filter on and group by, the time buckets as formats
+# of the local commit time
+GROUPS = ("author", "domain", "timezone", "extension")
+TIME_GROUPS = {
+    "year": "%Y",
+    "month": "%Y-%m",
+    "day": "%Y-%m-%d",
+    "weekday": None,
+    "hour": "%H",
+}
+
+
+class QueryError(Exception):
+    pass
+
+
+class CommitIndex:
+    """
+    The per-commit series of a run (see common.CommitSeries), sorted by
+    stamp and grouped by author, domain, timezone and extension. Each group
+    keeps its own stamps, so a date or tag range is two bisections into
+    the narrowest group of the query, only the rows in between are looked
+    at. Tag ranges are taken as the stamps of the tagged commits.
+    """
+    def __init__(self, series, tags):
+        self.names = series.names
+        self.tags = tags
+        order = sorted(range(len(series)), key=series.stamps.__getitem__)
+        self.stamps = array("q", (series.stamps[row] for row in order))
+        self.columns = {
+            "author": array("q", (series.authors[row] for row in order)),
+            "domain": array("q", (series.domains[row] for row in order)),
+            "timezone": array("q", (series.timezones[row] for row in order)),
+        }
+        self.merges = array("b", (series.merges[row] for row in order))
+        self.files = array("q", (series.files[row] for row in order))
+        self.inserted = array("q", (series.inserted[row] for row in order))
+        self.deleted = array("q", (series.deleted[row] for row in order))
+        # the commit rows per extension, with the lines of that extension
+        rank = array("q", bytes(8 * len(order)))
+        for (position, row) in enumerate(order):
+            rank[row] = position
+        ext_order = sorted(range(len(series.ext_rows)),
+                           key=lambda ext: rank[series.ext_rows[ext]])
+        self.ext_rows = array("q", (rank[series.ext_rows[ext]]
+                                    for ext in ext_order))
+        self.ext_inserted = array("q", (series.ext_inserted[ext]
+                                        for ext in ext_order))
+        self.ext_deleted = array("q", (series.ext_deleted[ext]
+                                       for ext in ext_order))
+        self.ext_ids = array("q", (series.ext_ids[ext] for ext in ext_order))
+        self.ext_stamps = array("q", (self.stamps[row]
+                                      for row in self.ext_rows))
+        self.ids = dict((column, dict(
+            (name, id) for (id, name) in enumerate(names)))
+            for (column, names) in self.names.items())
+
+        # column -> id -> (stamps, positions), both sorted
+        self.groups = {}
+        for (column, ids) in self.columns.items():
+            self.groups[column] = self.group(ids, range(len(ids)))
+        self.groups["extension"] = self.group(self.ext_ids, self.ext_rows)
+
+    def group(self, ids, rows):
+        groups = {}
+        for (position, (id, row)) in enumerate(zip(ids, rows)):
+            if id not in groups:
+                groups[id] = (array("q"), array("q"))
+            groups[id][0].append(self.stamps[row])
+            groups[id][1].append(position)
+        return groups
+
+    ##
+    # The stamps [since, until] selected by the since/until (YYYY-MM-DD or
+    # a unix stamp) and from_tag/to_tag parameters of `query`
+    def getrange(self, query):
+        since = -sys.maxsize
+        until = sys.maxsize
+        if "since" in query:
+            since = max(since, parsestamp(query["since"]))
+        if "until" in query:
+            until = min(until, parsestamp(query["until"], end=True))
+        if "from_tag" in query:
+            since = max(since, self.gettag(query["from_tag"])["stamp"] + 1)
+        if "to_tag" in query:
+            until = min(until, self.gettag(query["to_tag"])["stamp"])
+        return (since, until)
+
+    def gettag(self, tag):
+        if tag not in self.tags:
+            raise QueryError('no such tag "%s"' % tag)
+        return self.tags[tag]
+
+    ##
+    # Yield (row, ext, lines_added, lines_removed) for the commits matching
+    # `query`, oldest first. With an extension filter or `extensions` set
+    # there is one item per commit and extension (ext being the id of the
+    # extension) with the lines of that extension, otherwise one per commit
+    # with ext None.
+    def select(self, query, extensions=False):
+        (since, until) = self.getrange(query)
+        filters = {}  # column -> id
+        for column in GROUPS:
+            if column in query:
+                id = self.ids[column].get(query[column])
+                if id is None:
+                    return
+                filters[column] = id
+        extensions = extensions or "extension" in filters
+
+        # start from the narrowest group the query filters on
+        positions = None
+        for column, id in filters.items():
+            (stamps, group) = self.groups[column].get(id, ((), ()))
+            if positions is None or len(group) < len(positions[1]):
+                positions = (stamps, group, column)
+        if positions is None:
+            if extensions:
+                positions = (self.ext_stamps, range(len(self.ext_rows)),
+                             "extension")
+            else:
+                positions = (self.stamps, range(len(self.stamps)), None)
+        (stamps, group, column) = positions
+        selected = group[bisect_left(stamps, since):
+                         bisect_right(stamps, until)]
+
+        # extension rows are found through the commits for other groups
+        if extensions and column != "extension":
+            selected = self.getextensions(selected)
+        for position in selected:
+            if extensions:
+                (row, ext) = (self.ext_rows[position], position)
+            else:
+                (row, ext) = (position, None)
+            if any(self.getvalue(column, row, ext) != id
+                   for (column, id) in filters.items()):
+                continue
+            if ext is None:
+                yield (row, None, self.inserted[row], self.deleted[row])
+            else:
+                yield (row, ext, self.ext_inserted[ext], self.ext_deleted[ext])
+
+    ##
+    # The extension rows of the commit rows `rows`
+    def getextensions(self, rows):
+        for row in rows:
+            ext = bisect_left(self.ext_rows, row)
+            while ext < len(self.ext_rows) and self.ext_rows[ext] == row:
+                yield ext
+                ext += 1
+
+    def getvalue(self, column, row, ext):
+        if column == "extension":
+            return self.ext_ids[ext]
+        return self.columns[column][row]
+
+    ##
+    # The name of the group of `by` the item (row, ext) belongs to
+    def getkey(self, by, row, ext):
+        if by in TIME_GROUPS:
+            date = time.localtime(self.stamps[row])
+            if by == "weekday":
+                return WEEKDAYS[date.tm_wday]
+            return time.strftime(TIME_GROUPS[by], date)
+        return self.names[by][self.getvalue(by, row, ext)]
+
+    ##
+    # Commits, merges, lines added/removed and authors of the commits
+    # matching `query`, in total and per group of query["by"] if given
+    def stats(self, query):
+        by = query.get("by")
+        if by is not None and by not in GROUPS and by not in TIME_GROUPS:
+            raise QueryError('cannot group by "%s"' % by)
+        total = Stats()
+        groups = {}  # name -> Stats
+        for (row, ext, added, removed) in self.select(
+                query, extensions=(by == "extension")):
+            total.add(self, row, added, removed)
+            if by is not None:
+                key = self.getkey(by, row, ext)
+                if key not in groups:
+                    groups[key] = Stats()
+                groups[key].add(self, row, added, removed)
+        result = total.get()
+        if by is not None:
+            result["by_" + by] = dict(
+                (key, stats.get()) for (key, stats) in groups.items())
+        return result
+
+    ##
+    # The commits matching `query`, newest first, at most query["limit"]
+    def commits(self, query):
+        limit = parseint(query.get("limit", "100"), "limit")
+        rows = [row for (row, ext, added, removed) in self.select(query)]
+        result = []
+        for row in reversed(rows[len(rows) - limit:] if limit > 0 else []):
+            result.append({
+                "stamp": self.stamps[row],
+                "author": self.names["author"][self.columns["author"][row]],
+                "domain": self.names["domain"][self.columns["domain"][row]],
+                "timezone":
+                self.names["timezone"][self.columns["timezone"][row]],
+                "merge": bool(self.merges[row]),
+                "files": self.files[row],
+                "lines_added": self.inserted[row],
+                "lines_removed": self.deleted[row],
+            })
+        return {"total": len(rows), "commits": result}
+
+    ##
+    # Commits per name of `column`
+    def getnames(self, column):
+        return dict((self.names[column][id], len(group))
+                    for (id, (stamps, group)) in self.groups[column].items())
+
+    def summary(self):
+        return {
+            "commits": len(self.stamps),
+            "first_commit_stamp": self.stamps[0] if len(self.stamps) else 0,
+            "last_commit_stamp": self.stamps[-1] if len(self.stamps) else 0,
+            "authors": len(self.groups["author"]),
+            "domains": len(self.groups["domain"]),
+            "extensions": len(self.groups["extension"]),
+            "tags": len(self.tags),
+        }
+
+    def gettags(self):
+        return dict((tag, {
+            "stamp": info["stamp"],
+            "date": info["date"],
+            "commits": info["commits"],
+        }) for (tag, info) in self.tags.items())
+
+
+class Stats:
+    """Running totals of a selection of commits."""
+    def __init__(self):
+        self.rows = set()  # an item per commit and extension may repeat rows
+        self.merges = 0
+        self.lines_added = 0
+        self.lines_removed = 0
+        self.authors = set()
+        self.first_commit_stamp = 0
+        self.last_commit_stamp = 0
+
+    def add(self, index, row, added, removed):
+        if row not in self.rows:
+            self.rows.add(row)
+            self.merges += index.merges[row]
+            self.authors.add(index.columns["author"][row])
+            stamp = index.stamps[row]
+            if self.first_commit_stamp == 0:
+                self.first_commit_stamp = stamp
+            self.last_commit_stamp = stamp
+        self.lines_added += added
+        self.lines_removed += removed
+
+    def get(self):
+        return {
+            "commits": len(self.rows),
+            "merges": self.merges,
+            "lines_added": self.lines_added,
+            "lines_removed": self.lines_removed,
+            "authors": len(self.authors),
+            "first_commit_stamp": self.first_commit_stamp,
+            "last_commit_stamp": self.last_commit_stamp,
+        }
+
+
+def parseint(value, name):
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError('"%s" is not a number: %s' % (name, value))
+
+
+##
+# A unix stamp, or the start (end with `end`) of a local YYYY-MM-DD day
+def parsestamp(value, end=False):
+    if value.lstrip("-").isdigit():
+        return int(value)
+    try:
+        date = datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise QueryError('not a date (YYYY-MM-DD) or stamp: "%s"' % value)
+    if end:
+        date += datetime.timedelta(days=1)
+        return int(date.timestamp()) - 1
+    return int(date.timestamp())
+
+
+##
+# RangeIndex.getwindow() of the range of `query` (see CommitIndex.getrange)
+# with its files_by_stamp
+def getwindow(index, ranges, query):
+    (since, until) = index.getrange(query)
+    result = ranges.getwindow(since, until + 1)
+    result["files_by_stamp"] = ranges.getfilesbystamp(since, until + 1)
+    return result
+
+
+def getrollup(ranges, query):
+    period = query.get("period", "month")
+    try:
+        return ranges.rollup(period)
+    except ValueError as e:
+        raise QueryError(str(e))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET /                 summary
+    GET /stats            totals of the selected commits, per group of ?by=
+    GET /commits          the selected commits, newest first (?limit=100)
+    GET /authors, /domains, /timezones, /extensions
+                          commits per name
+    GET /tags             tags and their stamps
+    GET /window           totals and files_by_stamp of a range, from
+                          cumulative sums (see common.RangeIndex)
+    GET /rollup           totals per ?period= (day, week, month, quarter
+                          or year)
+
+    Commits are selected with author, domain, timezone, extension, since,
+    until, from_tag and to_tag parameters. by is one of author, domain,
+    timezone, extension, year, month, day, weekday or hour.
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict((key, values[-1])
+                     for (key, values) in parse_qs(url.query).items())
+        index = self.server.index
+        ranges = self.server.ranges
+        routes = {
+            "/": index.summary,
+            "/stats": lambda: index.stats(query),
+            "/commits": lambda: index.commits(query),
+            "/authors": lambda: index.getnames("author"),
+            "/domains": lambda: index.getnames("domain"),
+            "/timezones": lambda: index.getnames("timezone"),
+            "/extensions": lambda: index.getnames("extension"),
+            "/tags": index.gettags,
+            "/window": lambda: getwindow(index, ranges, query),
+            "/rollup": lambda: getrollup(ranges, query),
+        }
+        path = url.path.rstrip("/") or "/"
+        if path not in routes:
+            self.reply(404, {"error": "no such path: %s" % url.path})
+            return
+        try:
+            self.reply(200, routes[path]())
+        except QueryError as e:
+            self.reply(400, {"error": str(e)})
+
+    def reply(self, status, value):
+        body = encodejson(value)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+##
+# The commits (a CommitSeries), tags and files_by_stamp of the last run that
+# wrote `cache`, None if it collected no commits. The commits are merged
+# from the history aggregates cached per repository, which the run lists
+# in cache["serve"]["history"].
+def loadserve(cache):
+    section = cache["serve"]
+    if "history" not in section:
+        return None
+    series = CommitSeries()
+    files_by_stamp = {}
+    for key in section["history"]:
+        entry = cache["history"].get(key)
+        if entry is None:
+            return None
+        series.merge(entry["state"]["commit_series"])
+        files_by_stamp.update(entry["state"]["files_by_stamp"])
+    return (series, section["tags"], files_by_stamp)
+
+
+##
+# Answer queries over the commits of the last run that wrote `cachefile`
+# on http://127.0.0.1:`port`/ until interrupted
+def serve(cachefile, port):
+    if not os.path.exists(cachefile):
+        print("FATAL: No cache at %s, run gitstats first" % cachefile)
+        sys.exit(1)
+    cache = CacheStore()
+    cache.open(cachefile)
+    start = time.time()
+    data = loadserve(cache)
+    cache.close()
+    if data is None:
+        print("FATAL: No collected commits in %s, run gitstats first" %
+              cachefile)
+        sys.exit(1)
+    (series, tags, files_by_stamp) = data
+    index = CommitIndex(series, tags)
+    ranges = RangeIndex(series, files_by_stamp)
+    print("Indexed %d commits in %.3f secs" % (len(index.stamps),
+                                               time.time() - start))
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), QueryHandler)
+    server.index = index
+    server.ranges = ranges
+    print("Serving on http://127.0.0.1:%d/" % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,113 @@
+import datetime
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+# period -> format of the key of a window starting at a local date. Weeks
+# start on Monday and are not split at the turn of the year.
+PERIODS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-%W",
+    "month": "%Y-%m",
+    "quarter": None,  # YYYYQn
+    "year": "%Y",
+}
+
+
+class RangeIndex:
+    """
+    Totals of the commits of a CommitSeries in any [since, until) window,
+    answered from cumulative sums over the commits sorted by stamp: a
+    window is two bisections and a difference of sums. Active authors are
+    counted over the commits of the window, so they cost time in the
+    number of commits in it; files_by_stamp is sliced like the commits.
+    """
+    def __init__(self, series, files_by_stamp):
+        order = sorted(range(len(series)), key=series.stamps.__getitem__)
+        self.stamps = array("q", (series.stamps[row] for row in order))
+        # entry i is the total of the first i commits
+        self.merges = cumulative(series.merges[row] for row in order)
+        self.files = cumulative(series.files[row] for row in order)
+        self.inserted = cumulative(series.inserted[row] for row in order)
+        self.deleted = cumulative(series.deleted[row] for row in order)
+        self.authors = array("q", (series.authors[row] for row in order))
+        self.file_stamps = array("q", sorted(files_by_stamp))
+        self.file_counts = array("q", (files_by_stamp[stamp]
+                                       for stamp in self.file_stamps))
+
+    ##
+    # Commits, merges, files changed, lines added/removed and active authors
+    # in [since, until), and the number of files at the last commit of the
+    # window (0 if none is known)
+    def getwindow(self, since, until):
+        start = bisect_left(self.stamps, since)
+        end = max(start, bisect_left(self.stamps, until))
+        last = bisect_left(self.file_stamps, until) - 1
+        if last >= 0 and self.file_stamps[last] >= since:
+            files = self.file_counts[last]
+        else:
+            files = 0
+        return {
+            "commits": end - start,
+            "merges": self.merges[end] - self.merges[start],
+            "files_changed": self.files[end] - self.files[start],
+            "lines_added": self.inserted[end] - self.inserted[start],
+            "lines_removed": self.deleted[end] - self.deleted[start],
+            "authors": len(set(self.authors[start:end])),
+            "files": files,
+        }
+
+    ##
+    # stamp -> files of files_by_stamp in [since, until)
+    def getfilesbystamp(self, since, until):
+        start = bisect_left(self.file_stamps, since)
+        end = bisect_left(self.file_stamps, until)
+        return dict(zip(self.file_stamps[start:end],
+                        self.file_counts[start:end]))
+
+    ##
+    # key -> getwindow() of every `period` (see PERIODS) of local time from
+    # the first to the last commit, periods without commits included
+    def rollup(self, period):
+        if period not in PERIODS:
+            raise ValueError('no such period "%s"' % period)
+        windows = {}
+        if len(self.stamps) == 0:
+            return windows
+        date = getperiodstart(
+            datetime.datetime.fromtimestamp(self.stamps[0]), period)
+        while date.timestamp() <= self.stamps[-1]:
+            end = getperiodstart(date, period, 1)
+            windows[getperiodkey(date, period)] = self.getwindow(
+                int(date.timestamp()), int(end.timestamp()))
+            date = end
+        return windows
+
+
+def cumulative(values):
+    return array("q", accumulate(values, initial=0))
+
+
+##
+# The local start of the `period` containing `date`, or of the `offset`th
+# period after it
+def getperiodstart(date, period, offset=0):
+    date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        return date + datetime.timedelta(days=offset)
+    if period == "week":
+        return date - datetime.timedelta(days=date.weekday() - 7 * offset)
+    if period == "year":
+        return date.replace(year=date.year + offset, month=1, day=1)
+    months = {"month": 1, "quarter": 3}[period]
+    month = (date.month - 1) // months * months + offset * months
+    return date.replace(year=date.year + month // 12,
+                        month=month % 12 + 1,
+                        day=1)
+
+
+def getperiodkey(date, period):
+    if period == "quarter":
+        return "%dQ%d" % (date.year, (date.month - 1) // 3 + 1)
+    return date.strftime(PERIODS[period])
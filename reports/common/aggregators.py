@@ -0,0 +1,622 @@
+import datetime
+import time
+
+from array import array
+from functools import partial
+from .utils import getnumoffilesfromrev, mergecounts
+from .executor import getexecutor
+from .constans import conf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# With -z the output is a sequence of NUL terminated records: the header of
+# every commit, its fields separated by NUL, followed (with NUMSTAT_OPTIONS)
+# by a newline and "<added>\t<removed>\t<path>" (--numstat, renames as
+# "<added>\t<removed>\t", old path and new path) and newline separated
+# " create mode ..." / " delete mode ..." (--summary) records. Paths are
+# not quoted. Merges are diffed against their first parent so that the
+# mainline can be followed for line statistics.
+LOG_FORMAT = "%x00%H%x00%P%x00%T%x00%at%x00%ct%x00%ai%x00%aN%x00%aE"
+LOG_FIELDS = 8
+LOG_OPTIONS = ["--date-order", "-z"]
+NUMSTAT_OPTIONS = ["--numstat", "--summary", "--diff-merges=first-parent"]
+
+
+class Commit:
+    """A single commit as read from the history walk."""
+    __slots__ = ("hash", "parents", "tree", "stamp", "committer_stamp",
+                 "localdate", "timezone", "author", "mail", "domain", "files",
+                 "inserted", "deleted", "files_delta", "paths")
+
+    def __init__(self, fields):
+        (self.hash, parents, self.tree, stamp, committer_stamp, isodate,
+         self.author, self.mail) = fields
+        self.parents = parents.split()
+        try:
+            self.stamp = int(stamp)
+        except ValueError:
+            self.stamp = 0
+        try:
+            self.committer_stamp = int(committer_stamp)
+        except ValueError:
+            self.committer_stamp = 0
+        self.localdate = None
+        self.timezone = isodate.rsplit(" ", 1)[-1]
+        self.domain = "?"
+        if self.mail.find("@") != -1:
+            self.domain = self.mail.rsplit("@", 1)[1]
+        self.files = 0
+        self.inserted = 0
+        self.deleted = 0
+        self.files_delta = 0  # files created minus files deleted
+        self.paths = []  # (path, lines added, lines removed)
+
+    ##
+    # Local date of the commit, only computed when an aggregator needs it
+    @property
+    def date(self):
+        if self.localdate is None:
+            self.localdate = datetime.datetime.fromtimestamp(float(self.stamp))
+        return self.localdate
+
+    def is_merge(self):
+        return len(self.parents) > 1
+
+
+##
+# Parse the NUL separated output records (bytes) of `git log
+# --pretty=format:LOG_FORMAT LOG_OPTIONS [NUMSTAT_OPTIONS]` into Commit
+# records, newest first. An empty record ends the diff of a commit.
+def parsecommits(records):
+    commit = None
+    fields = []  # header fields of the next commit
+    renamed = None  # [added, removed, old path] of a rename
+    for record in records:
+        if commit is None:
+            if len(fields) == 0 and len(record) == 0:
+                continue
+            fields.append(record)
+            if len(fields) < LOG_FIELDS:
+                continue
+            # the last field is followed by the diff, if any
+            (fields[-1], _, record) = fields[-1].partition(b"\n")
+            commit = Commit([field.decode("utf-8", "replace")
+                             for field in fields])
+            fields = []
+            if len(record) == 0:
+                continue
+        if renamed is not None:
+            renamed.append(record)
+            if len(renamed) == 4:
+                addpath(commit, renamed[0], renamed[1], renamed[3])
+                renamed = None
+        elif len(record) == 0:
+            yield commit
+            commit = None
+        elif record[0:1] == b" ":
+            # --summary
+            for line in record.split(b"\n"):
+                if line.startswith(b" create mode ") or line.startswith(
+                        b" copy "):
+                    commit.files_delta += 1
+                elif line.startswith(b" delete mode "):
+                    commit.files_delta -= 1
+        else:
+            parts = record.split(b"\t", 2)
+            if len(parts) != 3:
+                print('Warning: unexpected record "%s"' %
+                      record.decode("utf-8", "replace"))
+            elif len(parts[2]) == 0:
+                # a rename, the paths follow
+                renamed = parts[0:2]
+            else:
+                addpath(commit, parts[0], parts[1], parts[2])
+    if commit is not None:
+        yield commit
+
+
+##
+# Add a --numstat path to `commit`, binary files show "-" for both counts
+def addpath(commit, added, removed, path):
+    path = path.decode("utf-8", "replace")
+    commit.files += 1
+    if added != b"-":
+        commit.inserted += int(added)
+        commit.deleted += int(removed)
+        commit.paths.append((path, int(added), int(removed)))
+    else:
+        commit.paths.append((path, 0, 0))
+
+
+class Aggregator:
+    """Consumes commits from the history walk and updates a DataCollector."""
+    name = "aggregator"  # phase name in the timings
+
+    def __init__(self, data):
+        self.data = data
+
+    ##
+    # Called for every commit, newest first (`git log --date-order`).
+    def process(self, commit):
+        pass
+
+    ##
+    # Called once after the last commit.
+    def finish(self):
+        pass
+
+
+class ActivityAggregator(Aggregator):
+    name = "activity"
+
+    def process(self, commit):
+        data = self.data
+        stamp = commit.stamp
+        date = commit.date
+        data.total_commits += 1
+
+        # First and last commit stamp (may be in any order because of cherry-picking and patches)
+        if stamp > data.last_commit_stamp:
+            data.last_commit_stamp = stamp
+        if data.first_commit_stamp == 0 or stamp < data.first_commit_stamp:
+            data.first_commit_stamp = stamp
+
+        # hour
+        hour = date.hour
+        data.activity_by_hour_of_day[hour] = (
+            data.activity_by_hour_of_day.get(hour, 0) + 1)
+        # most active hour?
+        if (data.activity_by_hour_of_day[hour] >
+                data.activity_by_hour_of_day_busiest):
+            data.activity_by_hour_of_day_busiest = data.activity_by_hour_of_day[
+                hour]
+
+        # day of week
+        day = date.weekday()
+        data.activity_by_day_of_week[day] = (
+            data.activity_by_day_of_week.get(day, 0) + 1)
+
+        # hour of week
+        if day not in data.activity_by_hour_of_week:
+            data.activity_by_hour_of_week[day] = {}
+        data.activity_by_hour_of_week[day][hour] = (
+            data.activity_by_hour_of_week[day].get(hour, 0) + 1)
+        # most active hour?
+        if (data.activity_by_hour_of_week[day][hour] >
+                data.activity_by_hour_of_week_busiest):
+            data.activity_by_hour_of_week_busiest = data.activity_by_hour_of_week[
+                day][hour]
+
+        # month of year
+        month = date.month
+        data.activity_by_month_of_year[month] = (
+            data.activity_by_month_of_year.get(month, 0) + 1)
+
+        # yearly/weekly activity
+        yyw = date.strftime("%Y-%W")
+        data.activity_by_year_week[yyw] = data.activity_by_year_week.get(
+            yyw, 0) + 1
+        if data.activity_by_year_week_peak < data.activity_by_year_week[yyw]:
+            data.activity_by_year_week_peak = data.activity_by_year_week[yyw]
+
+        yymm = date.strftime("%Y-%m")
+        data.commits_by_month[yymm] = data.commits_by_month.get(yymm, 0) + 1
+        yy = date.year
+        data.commits_by_year[yy] = data.commits_by_year.get(yy, 0) + 1
+
+        # project: active days
+        yymmdd = date.strftime("%Y-%m-%d")
+        if yymmdd != data.last_active_day:
+            data.last_active_day = yymmdd
+            data.active_days.add(yymmdd)
+
+
+class AuthorsAggregator(Aggregator):
+    name = "authors"
+
+    def __init__(self, data):
+        Aggregator.__init__(self, data)
+        self.names = set()
+
+    def process(self, commit):
+        data = self.data
+        author = data.authors.getid(commit.author)
+        date = commit.date
+        self.names.add(author)
+
+        info = data.authors.infos[author]
+        # commits, note again that commits may be in any date order because of cherry-picking and patches
+        info.addstamp(commit.stamp)
+
+        # author of the month/year
+        yymm = date.strftime("%Y-%m")
+        if yymm not in data.author_of_month:
+            data.author_of_month[yymm] = {}
+        data.author_of_month[yymm][author] = (
+            data.author_of_month[yymm].get(author, 0) + 1)
+        yy = date.year
+        if yy not in data.author_of_year:
+            data.author_of_year[yy] = {}
+        data.author_of_year[yy][author] = (
+            data.author_of_year[yy].get(author, 0) + 1)
+
+        # authors: active days
+        day = date.toordinal()
+        if day != info.last_active_day:
+            info.addday(day)
+
+    def finish(self):
+        self.data.total_authors += len(self.names)
+
+
+class DomainsAggregator(Aggregator):
+    name = "domains"
+
+    def process(self, commit):
+        domains = self.data.domains
+        if commit.domain not in domains:
+            domains[commit.domain] = {}
+        domains[commit.domain]["commits"] = domains[commit.domain].get(
+            "commits", 0) + 1
+
+
+class TimezoneAggregator(Aggregator):
+    name = "timezones"
+
+    def process(self, commit):
+        commits_by_timezone = self.data.commits_by_timezone
+        commits_by_timezone[commit.timezone] = (
+            commits_by_timezone.get(commit.timezone, 0) + 1)
+
+
+class ColumnarActivityAggregator(Aggregator):
+    """
+    Does the work of the activity, authors, domains and timezone aggregators
+    with NumPy: commits are collected as columns of stamps and interned
+    author/domain/timezone ids, and all time buckets are computed at once
+    in finish() instead of formatting dates for every commit.
+    """
+    name = "activity"
+
+    def __init__(self, data):
+        Aggregator.__init__(self, data)
+        self.stamps = array("q")
+        self.author_ids = array("q")
+        self.domain_ids = array("q")
+        self.timezone_ids = array("q")
+        self.authors = {}  # name -> id
+        self.domains = {}
+        self.timezones = {}
+
+    def process(self, commit):
+        self.stamps.append(commit.stamp)
+        self.author_ids.append(
+            self.authors.setdefault(commit.author, len(self.authors)))
+        self.domain_ids.append(
+            self.domains.setdefault(commit.domain, len(self.domains)))
+        self.timezone_ids.append(
+            self.timezones.setdefault(commit.timezone, len(self.timezones)))
+
+    def finish(self):
+        data = self.data
+        count = len(self.stamps)
+        data.total_commits += count
+        data.total_authors += len(self.authors)
+        if count == 0:
+            return
+        stamps = numpy.frombuffer(self.stamps, dtype=numpy.int64)
+        author_ids = numpy.frombuffer(self.author_ids, dtype=numpy.int64)
+        authors = list(self.authors)
+        ids = [data.authors.getid(name) for name in authors]  # in data.authors
+
+        # local time, as datetime.fromtimestamp() would give it
+        local = stamps + getlocaloffsets(stamps)
+        days = local // 86400
+        hours = (local - days * 86400) // 3600
+        weekdays = (days + 3) % 7  # 1970-01-01 was a Thursday
+        dates = days.astype("datetime64[D]")
+        months = dates.astype("datetime64[M]").astype(numpy.int64)
+        years = dates.astype("datetime64[Y]")
+        yeardays = days - years.astype("datetime64[D]").astype(numpy.int64)
+        years = years.astype(numpy.int64) + 1970
+        weeks = (yeardays + 7 - weekdays) // 7  # strftime("%W")
+
+        # First and last commit stamp
+        data.last_commit_stamp = max(data.last_commit_stamp,
+                                     int(stamps.max()))
+        if data.first_commit_stamp == 0 or stamps.min() < data.first_commit_stamp:
+            data.first_commit_stamp = int(stamps.min())
+
+        # hour, day of week, hour of week, month of year
+        mergecounts(data.activity_by_hour_of_day, countsbykey(hours))
+        data.activity_by_hour_of_day_busiest = max(
+            data.activity_by_hour_of_day.values())
+        mergecounts(data.activity_by_day_of_week, countsbykey(weekdays))
+        for (key, commits) in countsbykey(weekdays * 24 + hours).items():
+            (day, hour) = divmod(key, 24)
+            if day not in data.activity_by_hour_of_week:
+                data.activity_by_hour_of_week[day] = {}
+            mergecounts(data.activity_by_hour_of_week[day], {hour: commits})
+        data.activity_by_hour_of_week_busiest = max(
+            data.activity_by_hour_of_week_busiest,
+            max(commits for hours in data.activity_by_hour_of_week.values()
+                for commits in hours.values()))
+        mergecounts(data.activity_by_month_of_year,
+                    countsbykey(months % 12 + 1))
+
+        # yearly/weekly activity
+        mergecounts(data.activity_by_year_week,
+                    dict(("%04d-%02d" % divmod(key, 100), commits)
+                         for (key, commits) in countsbykey(years * 100 +
+                                                           weeks).items()))
+        data.activity_by_year_week_peak = max(
+            data.activity_by_year_week.values())
+
+        # commits and author of the month/year
+        month_names = dict(
+            (key, formatmonth(key)) for key in numpy.unique(months).tolist())
+        mergecounts(data.commits_by_month,
+                    dict((month_names[key], commits)
+                         for (key, commits) in countsbykey(months).items()))
+        mergecounts(data.commits_by_year, countsbykey(years))
+        for (key, commits) in countsbykey(months * len(authors) +
+                                          author_ids).items():
+            (month, author) = divmod(key, len(authors))
+            month = month_names[month]
+            if month not in data.author_of_month:
+                data.author_of_month[month] = {}
+            mergecounts(data.author_of_month[month], {ids[author]: commits})
+        for (key, commits) in countsbykey(years * len(authors) +
+                                          author_ids).items():
+            (year, author) = divmod(key, len(authors))
+            if year not in data.author_of_year:
+                data.author_of_year[year] = {}
+            mergecounts(data.author_of_year[year], {ids[author]: commits})
+
+        # active days
+        (unique_days, day_index) = numpy.unique(days, return_inverse=True)
+        day_names = numpy.datetime_as_string(
+            unique_days.astype("datetime64[D]")).tolist()
+        data.active_days.update(day_names)
+        data.last_active_day = day_names[day_index[-1]]
+
+        # authors: first/last commit, active days
+        first = numpy.full(len(authors), numpy.iinfo(numpy.int64).max)
+        last = numpy.full(len(authors), numpy.iinfo(numpy.int64).min)
+        numpy.minimum.at(first, author_ids, stamps)
+        numpy.maximum.at(last, author_ids, stamps)
+        # the last commit of every author in walk order
+        (_, last_index) = numpy.unique(author_ids[::-1], return_index=True)
+        last_index = count - 1 - last_index
+        day_ordinals = (unique_days + EPOCH_ORDINAL).tolist()
+        active_days = [[] for _ in authors]  # sorted day ordinals
+        for key in numpy.unique(author_ids * len(day_names) +
+                                day_index).tolist():
+            (author, day) = divmod(key, len(day_names))
+            active_days[author].append(day_ordinals[day])
+        for (author, id) in enumerate(ids):
+            info = data.authors.infos[id]
+            info.addstamp(int(first[author]))
+            info.addstamp(int(last[author]))
+            info.adddays(active_days[author])
+            info.last_active_day = day_ordinals[day_index[last_index[author]]]
+
+        # domains and timezones
+        domains = list(self.domains)
+        for (domain, commits) in countsbykey(
+                numpy.frombuffer(self.domain_ids, dtype=numpy.int64)).items():
+            if domains[domain] not in data.domains:
+                data.domains[domains[domain]] = {}
+            mergecounts(data.domains[domains[domain]], {"commits": commits})
+        timezones = list(self.timezones)
+        mergecounts(
+            data.commits_by_timezone,
+            dict((timezones[timezone], commits)
+                 for (timezone, commits) in countsbykey(
+                     numpy.frombuffer(self.timezone_ids,
+                                      dtype=numpy.int64)).items()))
+
+
+# datetime.date.toordinal() of day 0 of the stamps
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+##
+# {value: number of occurrences} of a NumPy integer array
+def countsbykey(values):
+    (keys, counts) = numpy.unique(values, return_counts=True)
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
+##
+# "YYYY-MM" for a number of months since 1970-01
+def formatmonth(months):
+    return str(numpy.datetime64(months, "M"))
+
+
+##
+# UTC offset of the local timezone at each stamp. Offsets are looked up once
+# per day and only per commit on days with a DST transition.
+def getlocaloffsets(stamps):
+    (days, day_index) = numpy.unique(stamps // 86400, return_inverse=True)
+    start = numpy.array(
+        [time.localtime(day * 86400).tm_gmtoff for day in days.tolist()])
+    end = numpy.array(
+        [time.localtime(day * 86400 + 86399).tm_gmtoff
+         for day in days.tolist()])
+    offsets = start[day_index]
+    for i in numpy.nonzero((start != end)[day_index])[0].tolist():
+        offsets[i] = time.localtime(int(stamps[i])).tm_gmtoff
+    return offsets
+
+
+class FilesAggregator(Aggregator):
+    """
+    Number of files per revision. With conf["tree_diff_files"] each count is
+    derived from the first parent's count and the files created/deleted by
+    the commit; only root commits and commits whose parent lies outside of
+    the walked range get a full `ls-tree` listing.
+    """
+    name = "files_by_rev"
+
+    def __init__(self, data):
+        Aggregator.__init__(self, data)
+        self.revs = []  # (stamp, commit, tree, first parent, files delta)
+
+    def process(self, commit):
+        parent = commit.parents[0] if len(commit.parents) > 0 else None
+        self.revs.append((commit.stamp, commit.hash, commit.tree, parent,
+                          commit.files_delta))
+
+    def finish(self):
+        files_in_tree = self.data.cache["files_in_tree"]
+        walked = set(rev[1] for rev in self.revs)
+
+        revs_to_read = []
+        for (stamp, _, tree, parent, _) in self.revs:
+            if tree in files_in_tree:
+                continue
+            if (not conf["tree_diff_files"] or parent is None
+                    or parent not in walked):
+                revs_to_read.append((stamp, tree))
+        objects = self.data.getObjects()
+        if objects is not None:
+            for (_, tree) in revs_to_read:
+                files_in_tree[tree] = objects.countfiles(tree)
+        else:
+            for (_, tree, count) in getexecutor().imap_unordered(
+                    partial(getnumoffilesfromrev, cwd=self.data.dir),
+                    revs_to_read):
+                files_in_tree[tree] = count
+
+        # parents come after their children, so resolve oldest first
+        counts = {}  # commit -> files
+        for (stamp, commit, tree, parent, delta) in reversed(self.revs):
+            if tree not in files_in_tree:
+                files_in_tree[tree] = counts[parent] + delta
+            counts[commit] = files_in_tree[tree]
+            self.data.files_by_stamp[stamp] = counts[commit]
+
+
+class LineStatsAggregator(Aggregator):
+    """
+    Lines added/removed over time. Computation of lines of code by date is
+    better done on a linear history, so with conf["linear_linestats"] only
+    the first-parent chain of the walked head is considered. Otherwise
+    changes_by_date follows every commit in walk order and is computed from
+    the commit graph (see GitDataCollector.reorder()).
+    """
+    name = "line_stats"
+
+    def __init__(self, data):
+        Aggregator.__init__(self, data)
+        self.head = None
+        self.revs = {}  # commit -> (first parent, stamp, files, ins, del)
+        self.order = []
+
+    def process(self, commit):
+        if self.head is None:
+            self.head = commit.hash
+        if conf["linear_linestats"]:
+            parent = commit.parents[0] if len(commit.parents) > 0 else None
+            self.revs[commit.hash] = (parent, commit.stamp, commit.files,
+                                      commit.inserted, commit.deleted)
+        elif commit.is_merge():
+            self.order.append((commit.stamp, 0, 0, 0))
+        else:
+            self.order.append((commit.stamp, commit.files, commit.inserted,
+                               commit.deleted))
+
+    def finish(self):
+        data = self.data
+        if conf["linear_linestats"]:
+            rev = self.head
+            while rev in self.revs:
+                (rev, stamp, files, inserted, deleted) = self.revs[rev]
+                self.order.append((stamp, files, inserted, deleted))
+
+        total_lines = 0
+        for (stamp, files, inserted, deleted) in reversed(self.order):
+            total_lines += inserted
+            total_lines -= deleted
+            data.total_lines_added += inserted
+            data.total_lines_removed += deleted
+            if conf["linear_linestats"]:
+                data.changes_by_date[stamp] = {
+                    "files": files,
+                    "ins": inserted,
+                    "del": deleted,
+                    "lines": total_lines,
+                }
+
+            date = datetime.datetime.fromtimestamp(stamp)
+            yymm = date.strftime("%Y-%m")
+            data.lines_added_by_month[yymm] = (
+                data.lines_added_by_month.get(yymm, 0) + inserted)
+            data.lines_removed_by_month[yymm] = (
+                data.lines_removed_by_month.get(yymm, 0) + deleted)
+
+            yy = date.year
+            data.lines_added_by_year[yy] = (
+                data.lines_added_by_year.get(yy, 0) + inserted)
+            data.lines_removed_by_year[yy] = (
+                data.lines_removed_by_year.get(yy, 0) + deleted)
+        data.total_lines += total_lines
+
+
+class AuthorStatsAggregator(Aggregator):
+    """
+    Lines added/removed and commits per author. Every commit is walked, not
+    just the mainline, so that we know who committed what; merges count as
+    commits without changed lines. The totals after every commit,
+    changes_by_date_by_author, are computed from the commit graph (see
+    GitDataCollector.reorder()).
+    """
+    name = "author_stats"
+
+    def process(self, commit):
+        info = self.data.authors.infos[self.data.authors.getid(commit.author)]
+        info.commits += 1
+        if not commit.is_merge():
+            info.lines_added += commit.inserted
+            info.lines_removed += commit.deleted
+
+
+class ChurnAggregator(Aggregator):
+    """
+    Commits, lines added/removed and authors per file and directory (see
+    common.ChurnIndex). Merges are left out, their changes are counted on
+    the branches they merge.
+    """
+    name = "churn"
+
+    def process(self, commit):
+        if not commit.is_merge():
+            self.data.churn.addcommit(self.data.authors.getid(commit.author),
+                                      commit.paths)
+
+
+class CommitSeriesAggregator(Aggregator):
+    """
+    Every commit as a row of the per-commit series (see
+    common.CommitSeries), which the query server indexes.
+    """
+    name = "commit_series"
+
+    def process(self, commit):
+        self.data.commit_series.add(commit)
+
+
+class CommitGraphAggregator(Aggregator):
+    """
+    Every commit as a row of the commit graph (see common.CommitGraph), which
+    the aggregates depending on the order of the walk are computed from.
+    """
+    name = "commit_graph"
+
+    def process(self, commit):
+        self.data.commit_graph.add(commit,
+                                   self.data.authors.getid(commit.author))
@@ -0,0 +1,51 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+##
+# Write columns ({name: list of values}) as a compressed NumPy archive;
+# string columns are stored as ids into a "<name>_names" array.
+def writenpz(path, columns):
+    if numpy is None:
+        raise ImportError("numpy is required for the npz series format")
+    arrays = {}
+    for name, values in columns.items():
+        if len(values) > 0 and isinstance(values[0], str):
+            (names, ids) = numpy.unique(values, return_inverse=True)
+            arrays[name] = ids.astype(numpy.int32)
+            arrays[name + "_names"] = names
+        else:
+            arrays[name] = numpy.array(values, dtype=numpy.int64)
+    numpy.savez_compressed(path, **arrays)
+
+
+##
+# Write columns ({name: list of values}) as a zstd compressed Parquet file;
+# string columns are dictionary encoded.
+def writeparquet(path, columns):
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for the parquet series format")
+    arrays = {}
+    for name, values in columns.items():
+        if len(values) > 0 and isinstance(values[0], str):
+            arrays[name] = pyarrow.array(values).dictionary_encode()
+        else:
+            arrays[name] = pyarrow.array(values, type=pyarrow.int64())
+    pyarrow.parquet.write_table(pyarrow.table(arrays),
+                                path,
+                                compression="zstd")
+
+
+# format -> (file extension, writer)
+SERIES_FORMATS = {
+    "npz": ("npz", writenpz),
+    "parquet": ("parquet", writeparquet),
+}
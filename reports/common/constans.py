@@ -3,9 +3,6 @@ import platform
 ON_LINUX = platform.system() == "Linux"
 ON_WIN = platform.system() == "Windows"
 
-FIND_CMD = "find /c /v \"\"" if ON_WIN else "wc -l"
-GREP_CMD = "findstr" if ON_WIN else "grep"
-
 conf = {
     "max_domains": 10,
     "max_ext_length": 10,
@@ -16,8 +13,25 @@ conf = {
     "commit_end": "HEAD",
     "linear_linestats": 1,
     "project_name": "",
-    "processes": 8,
+    "processes": "auto",
     "start_date": "",
+    "tree_diff_files": 1,
+    "history_shards": 1,
+    "columnar_activity": 1,
+    "series_format": "",
+    "json_indent": 0,
+    "json_gzip": 0,
+    "trace": 0,
+    "executor": "thread",
+    "chunk_size": 0,
+    "git_concurrency": 0,
+    "object_backend": "git",
+    "ownership": 0,
+    "churn_top": 20,
+    "serve_port": 8000,
+    "rollups": "",
+    "author_changes": "nested",
+    "metrics": "",
 }
 
 WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
@@ -0,0 +1,117 @@
+import os
+import threading
+from functools import partial
+from multiprocessing import get_context
+from multiprocessing.pool import ThreadPool
+
+from common.constans import conf
+from common import tracing
+
+# the executor shared by all phases of this process, see getexecutor()
+shared = None
+shared_lock = threading.Lock()
+
+
+##
+# Number of workers: conf["processes"], or the number of CPUs for "auto"
+def getprocesses():
+    if conf["processes"] == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(conf["processes"]))
+
+
+class Executor:
+    """
+    Runs tasks on a pool of threads (conf["executor"] = "thread") or of
+    processes ("process") that is created on first use and kept for the
+    rest of the run. Threads suit tasks that mostly wait on git processes.
+    Worker processes are spawned rather than forked, since the pool may be
+    created while other threads of the collection are running; they get a
+    copy of the configuration (see initworker()) and hand the spans they
+    record back with every result.
+    """
+    def __init__(self, mode="thread", processes=1):
+        if mode not in ("thread", "process"):
+            raise ValueError('no such executor "%s"' % mode)
+        self.mode = mode
+        self.processes = processes
+        self.pool = None
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def getpool(self):
+        with self.lock:
+            if self.pool is None:
+                if self.mode == "thread":
+                    self.pool = ThreadPool(self.processes)
+                else:
+                    self.pool = get_context("spawn").Pool(
+                        self.processes, initializer=initworker,
+                        initargs=(dict(conf), ))
+            return self.pool
+
+    ##
+    # Yield func(item) for every item of `items` in the order they complete.
+    # Tasks are handed to the workers in chunks of `chunksize` items,
+    # conf["chunk_size"] if not given; 0 spreads `items` over about four
+    # chunks per worker.
+    def imap_unordered(self, func, items, chunksize=None):
+        items = list(items)
+        if len(items) == 0:
+            return iter(())
+        if chunksize is None:
+            chunksize = conf["chunk_size"]
+        if chunksize <= 0:
+            chunksize = max(1, len(items) // (self.processes * 4))
+        if self.mode == "thread":
+            return self.getpool().imap_unordered(func, items, chunksize)
+        return self.collectspans(self.getpool().imap_unordered(
+            partial(runtask, func), items, chunksize))
+
+    def collectspans(self, results):
+        for (result, spans) in results:
+            tracing.extend(spans)
+            yield result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+##
+# Set up a worker process with the configuration `config` of its parent
+def initworker(config):
+    conf.update(config)
+
+
+##
+# func(item) in a worker process, with the spans recorded meanwhile
+def runtask(func, item):
+    tracing.drain()
+    result = func(item)
+    return (result, tracing.drain())
+
+
+##
+# The executor shared by all phases of this process. A forked worker process
+# does not inherit the pool of its parent but gets its own. The phases
+# running concurrently may ask for it at the same time.
+def getexecutor():
+    global shared
+    with shared_lock:
+        if shared is None or shared.pid != os.getpid():
+            shared = Executor(conf["executor"], getprocesses())
+        return shared
+
+
+##
+# Shut down the shared executor of this process once its phases are done;
+# the next getexecutor() creates a new one
+def closeexecutor():
+    global shared
+    with shared_lock:
+        if shared is not None and shared.pid == os.getpid():
+            shared.close()
+        shared = None
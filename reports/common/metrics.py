@@ -0,0 +1,103 @@
+from .constans import conf
+
+# collection phase -> phases it needs. The history walk feeds aggregators
+# (see common.aggregators), each of them a phase of its own; "numstat" is
+# the diff of every commit in the walk, which only some of them read, and
+# "commit_graph" the commits that aggregates depending on the order of the
+# walk are computed from.
+PHASES = {
+    "tags": (),
+    "files": (),  # the files at the head, from ls-tree
+    "blob_lines": ("files", ),  # lines of every blob at the head
+    "ownership": ("files", ),
+    "history": (),
+    "numstat": ("history", ),
+    "commit_graph": ("history", ),
+    # also authors, domains and timezones
+    "activity": ("history", "commit_graph"),
+    "files_by_rev": ("numstat", ),
+    "line_stats": ("numstat", "commit_graph"),
+    "author_stats": ("numstat", "commit_graph"),
+    "churn": ("numstat", ),
+    "commit_series": ("numstat", ),
+}
+
+ACTIVITY_SECTIONS = (
+    "total_authors", "activity_by_hour_of_day", "activity_by_day_of_week",
+    "activity_by_month_of_year", "activity_by_hour_of_week",
+    "activity_by_hour_of_day_busiest", "activity_by_hour_of_week_busiest",
+    "activity_by_year_week", "total_commits", "domains", "author_of_month",
+    "author_of_year", "commits_by_month", "commits_by_year",
+    "first_commit_stamp", "last_commit_stamp", "last_active_day",
+    "active_days", "commits_by_timezone")
+LINE_SECTIONS = (
+    "lines_added_by_month", "lines_added_by_year", "lines_removed_by_month",
+    "lines_removed_by_year", "total_lines", "total_lines_added",
+    "total_lines_removed", "changes_by_date")
+
+# report section -> phases it is collected by. "commit_series" is not a
+# section of the report but the series kept for `gitstats serve`.
+METRICS = dict([(section, ("activity", )) for section in ACTIVITY_SECTIONS] +
+               [(section, ("line_stats", )) for section in LINE_SECTIONS] + [
+                   ("authors", ("activity", "author_stats")),
+                   ("authors_by_commits", ("activity", "author_stats")),
+                   ("changes_by_date_by_author", ("author_stats", )),
+                   ("total_files", ("files", )),
+                   ("total_size", ("files", )),
+                   ("extensions", ("blob_lines", )),
+                   ("tags", ("tags", )),
+                   ("files_by_stamp", ("files_by_rev", )),
+                   ("ownership_by_author", ("ownership", )),
+                   ("ownership_by_extension", ("ownership", )),
+                   ("churn", ("churn", )),
+                   ("rollups", ("commit_series", "files_by_rev")),
+                   ("commit_series", ("commit_series", )),
+               ])
+
+# names for several sections at once in conf["metrics"]
+GROUPS = {
+    "activity": ACTIVITY_SECTIONS,
+    "authors": ("total_authors", "authors", "authors_by_commits",
+                "author_of_month", "author_of_year",
+                "changes_by_date_by_author"),
+    "lines": LINE_SECTIONS,
+    "files": ("total_files", "total_size", "extensions", "files_by_stamp"),
+    "ownership": ("ownership_by_author", "ownership_by_extension"),
+}
+
+
+##
+# The report sections of conf["metrics"] (comma separated sections or
+# groups), every section if it is empty. Ownership is only included in
+# every section with conf["ownership"].
+def getsections():
+    if len(conf["metrics"]) == 0:
+        return set(section for section in METRICS
+                   if conf["ownership"] or "ownership" not in METRICS[section])
+    sections = set()
+    for name in conf["metrics"].split(","):
+        if name in GROUPS:
+            sections.update(GROUPS[name])
+        elif name in METRICS:
+            sections.add(name)
+        else:
+            raise ValueError('no such metric "%s"' % name)
+    return sections
+
+
+##
+# The phases needed for the sections of getsections()
+def getphases():
+    phases = set()
+    pending = [phase for section in getsections()
+               for phase in METRICS[section]]
+    while len(pending) > 0:
+        phase = pending.pop()
+        if phase not in phases:
+            phases.add(phase)
+            pending.extend(PHASES[phase])
+    return phases
+
+
+def isselected(phase):
+    return phase in getphases()
@@ -0,0 +1,194 @@
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# spans finished in this process (and added from worker processes), each a
+# dict of name, category, start, wall, cpu, peak_rss_kb, pid, tid and args
+spans = []
+
+time_start = time.time()
+
+
+def getpeakrss():
+    if resource is None:
+        return 0
+    return getrsskb(max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+
+def getrsskb(maxrss):
+    if sys.platform == "darwin":
+        return maxrss // 1024  # bytes
+    return maxrss
+
+
+def getcputime():
+    # user and system time of this process and of its waited-for children
+    return sum(os.times()[0:4])
+
+
+class Span:
+    """
+    Times a block as a context manager: wall time, CPU time of the thread
+    running it, and the peak RSS reached until the block ends. Blocks that
+    share their thread with others (coroutines) are timed with cpu=False
+    and have no CPU time, as the process-wide one would count everything
+    running concurrently. Blocks running an external command take CPU time
+    and peak RSS of that process instead, see wait().
+    """
+    def __init__(self, name, category="phase", cpu=True, **args):
+        self.name = name
+        self.category = category
+        self.timecpu = cpu
+        self.args = args
+        self.usage = None  # (CPU time, peak RSS) of the command, see wait()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.cpu = time.thread_time()
+        self.started = time.time()
+
+    ##
+    # Wait for the process of the subprocess.Popen `process`, run by the
+    # block, and take its own CPU time and peak RSS where os.wait4() is
+    # available. Linux counts the memory a process was started from in
+    # its peak RSS, so that of a command is at least what this process
+    # had when starting it.
+    def wait(self, process):
+        if not hasattr(os, "wait4"):
+            process.wait()
+            return
+        try:
+            (_, status, usage) = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # already reaped
+            process.wait()
+            return
+        process.returncode = os.waitstatus_to_exitcode(status)
+        self.usage = (usage.ru_utime + usage.ru_stime,
+                      getrsskb(usage.ru_maxrss))
+
+    def stop(self):
+        if self.usage is not None:
+            (cpu, peak_rss_kb) = self.usage
+        else:
+            cpu = (time.thread_time() - self.cpu) if self.timecpu else None
+            peak_rss_kb = getpeakrss()
+        spans.append({
+            "name": self.name,
+            "category": self.category,
+            "start": self.started,
+            "wall": time.time() - self.started,
+            "cpu": cpu,
+            "peak_rss_kb": peak_rss_kb,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": self.args,
+        })
+
+
+def span(name, category="phase", cpu=True, **args):
+    return Span(name, category, cpu, **args)
+
+
+##
+# Add a phase whose time was summed up elsewhere (e.g. the time spent in an
+# aggregator over all commits); it has no place on the trace timeline
+def record(name, wall, category="phase", **args):
+    spans.append({
+        "name": name,
+        "category": category,
+        "start": None,
+        "wall": wall,
+        "cpu": None,
+        "peak_rss_kb": None,
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": args,
+    })
+
+
+##
+# Remove and return the spans of this process, e.g. to pass them from a
+# worker process to the main process, which adds them with extend()
+def drain():
+    finished = spans[:]
+    del spans[:]
+    return finished
+
+
+def extend(finished):
+    spans.extend(finished)
+
+
+##
+# Totals per phase and per external command (grouped by git subcommand),
+# for the "timings" section of the report
+def gettimings():
+    timings = {
+        "wall": time.time() - time_start,
+        "cpu": getcputime(),
+        "peak_rss_kb": getpeakrss(),
+        "phases": {},
+        "commands": {},
+    }
+    for s in spans:
+        if s["category"] == "command":
+            group = timings["commands"]
+            name = " ".join(s["name"].split()[0:2])
+        else:
+            group = timings["phases"]
+            name = s["name"]
+        if name not in group:
+            group[name] = {
+                "count": 0,
+                "wall": 0.0,
+                "cpu": None,  # unless a span has CPU time (see Span)
+                "peak_rss_kb": 0
+            }
+        total = group[name]
+        total["count"] += 1
+        total["wall"] += s["wall"]
+        if s["cpu"] is not None:
+            total["cpu"] = (total["cpu"] or 0.0) + s["cpu"]
+        if s["peak_rss_kb"] is not None:
+            total["peak_rss_kb"] = max(total["peak_rss_kb"],
+                                       s["peak_rss_kb"])
+    return timings
+
+
+##
+# Write the spans as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+def writetrace(path):
+    events = []
+    for s in spans:
+        if s["start"] is None:
+            continue
+        args = dict(s["args"])
+        args.update(cpu=s["cpu"], peak_rss_kb=s["peak_rss_kb"])
+        events.append({
+            "name": s["name"],
+            "cat": s["category"],
+            "ph": "X",
+            "ts": int((s["start"] - time_start) * 1000000),
+            "dur": int(s["wall"] * 1000000),
+            "pid": s["pid"],
+            "tid": s["tid"],
+            "args": args,
+        })
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
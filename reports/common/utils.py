@@ -1,43 +1,178 @@
+import asyncio
 import time
 import sys
 import subprocess
 import os
-import re
+from functools import partial
 from typing import Iterator
-from common.constans import FIND_CMD, ON_LINUX, conf
+from common.constans import ON_LINUX, conf
+from common.BlobReader import BlobReader
+from common.executor import getexecutor, getprocesses
+from common import tracing
 
 
-def getpipeoutput(cmds, quiet=False):
-    # global exectime_external
+def getpipeoutput(args, quiet=False, cwd=None):
+    """
+    Run the command `args` (a list, not passed to a shell) and return its
+    output, decoded and without the trailing newline. Raises
+    subprocess.CalledProcessError if the command fails.
+    """
+    cmd = " ".join(args)
+    span = tracing.span(cmd, "command", cpu=False)
+    span.start()
     start = time.time()
     if not quiet and ON_LINUX and os.isatty(1):
-        print(">> " + " | ".join(cmds))
+        print(">> " + cmd)
         sys.stdout.flush()
-    p = subprocess.Popen(cmds[0], stdout=subprocess.PIPE, shell=True)
-    processes = [p]
-    for x in cmds[1:]:
-        p = subprocess.Popen(x,
-                             stdin=p.stdout,
-                             stdout=subprocess.PIPE,
-                             shell=True)
-        processes.append(p)
-    output = p.communicate()[0]
-    for p in processes:
-        p.wait()
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=cwd)
+    with p.stdout:
+        output = p.stdout.read()
+    span.wait(p)
     end = time.time()
+    span.stop()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
     if not quiet:
         if ON_LINUX and os.isatty(1):
             print("\r"),
-        print("[%.5f] >> %s" % (end - start, " | ".join(cmds)))
-    # exectime_external += end - start
+        print("[%.5f] >> %s" % (end - start, cmd))
     return bytes.decode(output).rstrip("\n")
 
 
-def getlogrange(defaultrange="HEAD", end_only=True):
-    commit_range = getcommitrange(defaultrange, end_only)
+def getpipeoutputstream(args,
+                        separator=b"\n",
+                        quiet=False,
+                        bufsize=1 << 16,
+                        cwd=None):
+    """
+    Like getpipeoutput, but yield the raw output records (bytes, without the
+    separator) of the command as they are produced instead of collecting
+    the whole output first. Without a separator the output is yielded in
+    chunks as read. Raises subprocess.CalledProcessError after the last
+    record if the command fails.
+    """
+    cmd = " ".join(args)
+    span = tracing.span(cmd, "command", cpu=False)
+    span.start()
+    start = time.time()
+    if not quiet and ON_LINUX and os.isatty(1):
+        print(">> " + cmd)
+        sys.stdout.flush()
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=cwd)
+    try:
+        pending = b""
+        while True:
+            chunk = p.stdout.read1(bufsize)
+            if not chunk:
+                break
+            if separator is None:
+                yield chunk
+                continue
+            records = (pending + chunk).split(separator)
+            pending = records.pop()
+            yield from records
+        if len(pending) > 0:
+            yield pending
+    finally:
+        p.stdout.close()
+        span.wait(p)
+        span.stop()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
+    end = time.time()
+    if not quiet:
+        if ON_LINUX and os.isatty(1):
+            print("\r"),
+        print("[%.5f] >> %s" % (end - start, cmd))
+
+
+##
+# Number of lines the command `args` outputs, like piping it to `wc -l`
+def getpipeoutputlinecount(args, quiet=False, cwd=None):
+    return sum(
+        chunk.count(b"\n") for chunk in getpipeoutputstream(
+            args, separator=None, quiet=quiet, cwd=cwd))
+
+
+# limits the git processes started by the coroutines of one event loop
+COMMAND_LIMIT = None
+
+
+def getcommandlimit():
+    global COMMAND_LIMIT
+    loop = asyncio.get_running_loop()
+    if COMMAND_LIMIT is None or COMMAND_LIMIT[0] is not loop:
+        limit = conf["git_concurrency"]
+        if limit <= 0:
+            limit = getprocesses()
+        COMMAND_LIMIT = (loop, asyncio.Semaphore(limit))
+    return COMMAND_LIMIT[1]
+
+
+async def getpipeoutputstreamasync(args,
+                                   separator=b"\n",
+                                   quiet=False,
+                                   bufsize=1 << 16,
+                                   cwd=None):
+    """
+    Like getpipeoutputstream, but run the command `args` (a list, not passed
+    to a shell) as a coroutine, at most conf["git_concurrency"] at once,
+    and yield its output records as they arrive. Without a separator the
+    output is yielded in chunks as read. Raises
+    subprocess.CalledProcessError after the last record if the command
+    fails.
+    """
+    cmd = " ".join(args)
+    async with getcommandlimit():
+        span = tracing.span(cmd, "command", cpu=False)
+        span.start()
+        start = time.time()
+        # started with subprocess rather than asyncio, so that the process
+        # is reaped here with its resource usage (see tracing.Span.wait())
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=cwd)
+        stdout = asyncio.StreamReader(limit=bufsize)
+        (transport, _) = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(stdout), p.stdout)
+        try:
+            pending = b""
+            while True:
+                chunk = await stdout.read(bufsize)
+                if not chunk:
+                    break
+                if separator is None:
+                    yield chunk
+                    continue
+                records = (pending + chunk).split(separator)
+                pending = records.pop()
+                for record in records:
+                    yield record
+            if len(pending) > 0:
+                yield pending
+        finally:
+            if not stdout.at_eof():
+                p.kill()
+            transport.close()
+            await asyncio.to_thread(span.wait, p)
+            span.stop()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
+    if not quiet:
+        print("[%.5f] >> %s" % (time.time() - start, cmd))
+
+
+##
+# Arguments selecting the commits to walk for `git log`/`git rev-list`
+def getlogrange(defaultrange="HEAD", end_only=True, exclude=None, head=None):
+    if head is not None:
+        commit_range = head
+    else:
+        commit_range = getcommitrange(defaultrange, end_only)
+    if exclude is not None:
+        # only commits that are not reachable from `exclude`
+        commit_range = "%s..%s" % (exclude, commit_range)
     if len(conf["start_date"]) > 0:
-        return '--since="%s" "%s"' % (conf["start_date"], commit_range)
-    return commit_range
+        return ["--since=%s" % conf["start_date"], commit_range]
+    return [commit_range]
 
 
 def getcommitrange(defaultrange="HEAD", end_only=False):
@@ -59,20 +194,10 @@ def getkeyssortedbyvaluekey(d, key):
                sorted(map(lambda el: (d[el][key], el), d.keys()))))
 
 
-def getstatsummarycounts(line):
-    numbers = re.findall(r"\d+", line)
-    if len(numbers) == 1:
-        # neither insertions nor deletions:
-        # may probably only happen for "0 files changed"
-        numbers.append(0)
-        numbers.append(0)
-    elif len(numbers) == 2 and line.find("(+)") != -1:
-        numbers.append(0)
-        # only insertions were printed on line
-    elif len(numbers) == 2 and line.find("(-)") != -1:
-        numbers.insert(1, 0)
-        # only deletions were printed on line
-    return numbers
+# counts['key'] += other['key'] for every key of other
+def mergecounts(counts, other):
+    for key, value in other.items():
+        counts[key] = counts.get(key, 0) + value
 
 
 VERSION = 0
@@ -83,18 +208,18 @@ def getversion():
     if VERSION == 0:
         gitstats_repo = os.path.dirname(os.path.abspath(__file__))
         VERSION = getpipeoutput([
-            "git --git-dir=%s/.git --work-tree=%s rev-parse --short %s" %
-            (gitstats_repo, gitstats_repo,
-             getcommitrange("HEAD").split("\n")[0])
+            "git", "--git-dir=%s/.git" % gitstats_repo,
+            "--work-tree=%s" % gitstats_repo, "rev-parse", "--short",
+            getcommitrange("HEAD").split("\n")[0]
         ])
     return VERSION
 
 
 def getgitversion():
-    return getpipeoutput(["git --version"]).split("\n")[0]
+    return getpipeoutput(["git", "--version"]).split("\n")[0]
 
 
-def getnumoffilesfromrev(time_rev):
+def getnumoffilesfromrev(time_rev, cwd=None):
     """
     Get number of files changed in commit
     """
@@ -102,24 +227,85 @@ def getnumoffilesfromrev(time_rev):
     return (
         int(time),
         rev,
-        int(
-            getpipeoutput(['git ls-tree -r --name-only "%s"' % rev,
-                           FIND_CMD]).split("\n")[0]),
+        getpipeoutputlinecount(
+            ["git", "ls-tree", "-r", "--name-only", rev, "--"], cwd=cwd),
     )
 
 
-def getnumoflinesinblob(ext_blob):
+def getblame(path_blob, rev="HEAD", cwd=None):
     """
-	Get number of lines in blob
-	"""
-    ext, blob_id = ext_blob
-    return (
-        ext,
-        blob_id,
-        int(
-            getpipeoutput(["git cat-file blob %s" % blob_id,
-                           FIND_CMD]).split()[0]),
-    )
+    Get number of lines of a file at `rev` by the author who last changed
+    them, as (path, blob id, {author: lines})
+    """
+    path, blob_id = path_blob
+    commits = {}  # commit -> lines
+    authors = {}  # commit -> author
+    commit = None
+    for line in getpipeoutputstream(
+        ["git", "blame", "--porcelain", rev, "--", path], cwd=cwd):
+        if line.startswith(b"\t"):
+            # contents of the line
+            continue
+        fields = line.split(b" ")
+        if len(fields[0]) == 40 and len(fields) == 4:
+            # "<commit> <original line> <final line> <lines in group>"
+            commit = fields[0]
+            commits[commit] = commits.get(commit, 0) + int(fields[3])
+        elif fields[0] == b"author" and commit not in authors:
+            authors[commit] = line[7:].decode("utf-8", "replace")
+    owners = {}
+    for commit, lines in commits.items():
+        author = authors.get(commit, "")
+        owners[author] = owners.get(author, 0) + lines
+    return (path, blob_id, owners)
+
+
+##
+# Extension of the file at `path` as used in the report, "" if it has none
+# or it is longer than conf["max_ext_length"]
+def getextension(path):
+    filename = path.split("/")[-1]  # strip directories
+    if filename.find(".") == -1 or filename.rfind(".") == 0:
+        return ""
+    ext = filename[(filename.rfind(".") + 1):]
+    if len(ext) > conf["max_ext_length"]:
+        return ""
+    return ext
+
+
+##
+# Line counts of the blobs of `ext_blobs` ([(ext, blob id)]) as
+# [(ext, blob id, number of lines)], read by one `git cat-file --batch`
+def countlinesinblobs(ext_blobs, cwd=None):
+    with BlobReader(cwd) as reader:
+        counts = reader.iterlinecounts([blob_id for (_, blob_id) in ext_blobs])
+        return [(ext, blob_id, linecount)
+                for ((ext, _), (blob_id, linecount)) in zip(ext_blobs, counts)]
+
+
+def getnumoflinesinblobs(ext_blobs, cwd=None):
+    """
+    Get number of lines for many blobs through a few `git cat-file --batch`
+    processes instead of one pipeline per blob. Yields (ext, blob id, number
+    of lines) batch by batch as the shared executor completes them.
+    """
+    if len(ext_blobs) == 0:
+        return
+    span = tracing.span("blob_lines", blobs=len(ext_blobs))
+    span.start()
+    start = time.time()
+    executor = getexecutor()
+    # one batch (and cat-file process) per worker unless a chunk size is set
+    size = conf["chunk_size"]
+    if size <= 0:
+        size = -(-len(ext_blobs) // executor.processes)
+    batches = [ext_blobs[i:i + size] for i in range(0, len(ext_blobs), size)]
+    for results in executor.imap_unordered(
+            partial(countlinesinblobs, cwd=cwd), batches, 1):
+        yield from results
+    span.stop()
+    print("[%.5f] >> git cat-file --batch (%d blobs, %d batches)" %
+          (time.time() - start, len(ext_blobs), len(batches)))
 
 
 def html_linkify(text):
@@ -140,6 +326,7 @@ def html_header(level, text):
 def usage():
     print("""
 Usage: gitstats [options] <gitpath..> <outputpath>
+       gitstats [options] serve <outputpath>
 
 Options:
 -c key=value     Override configuration value
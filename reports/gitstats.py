@@ -1,23 +1,25 @@
 import sys
 import os
-import time
 import getopt
+import gzip
+import subprocess
 
-from common.GitDataCollector import GitDataCollector
+from common.GitDataCollector import GitDataCollector, collectrepository
+from common.QueryServer import serve
 from common.utils import usage
+from common.executor import getprocesses, closeexecutor
+from common.metrics import getsections, isselected
 from common.constans import conf
+from common import tracing
 
-if sys.version_info < (3, 8):
+if sys.version_info < (3, 9):
     sys.exit(1)
 
-from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 os.environ["LC_ALL"] = "C"
 
-exectime_internal = 0.0
-exectime_external = 0.0
-time_start = time.time()
-
 if __name__ == "__main__":
     args_orig = sys.argv[1:]
 
@@ -35,6 +37,19 @@ if __name__ == "__main__":
             usage()
             sys.exit()
 
+    # unknown metrics would only fail in the worker processes
+    try:
+        getsections()
+    except ValueError as e:
+        print("FATAL: %s" % e)
+        sys.exit(1)
+
+    # gitstats serve <outputpath>: query the commits of the last run
+    if len(args) == 2 and args[0] == "serve":
+        serve(os.path.join(os.path.abspath(args[1]), "gitstats.cache"),
+              conf["serve_port"])
+        sys.exit(0)
+
     if len(args) < 2:
         usage()
         sys.exit(0)
@@ -56,23 +71,62 @@ if __name__ == "__main__":
     data = GitDataCollector()
     data.loadCache(cachefile)
 
-    for gitpath in args[0:-1]:
-        print("Git path: %s" % gitpath)
-
-        prevdir = os.getcwd()
-        os.chdir(gitpath)
-
-        print("Collecting data...")
-        data.collect(gitpath)
+    # every repository is collected in its own process, the results are
+    # merged in the order the repositories were given
+    gitpaths = [os.path.abspath(gitpath) for gitpath in args[0:-1]]
+    print("Collecting data...")
+    try:
+        with ProcessPoolExecutor(
+                max_workers=min(len(gitpaths), getprocesses())) as executor:
+            results = executor.map(collectrepository, gitpaths,
+                                   repeat(cachefile), repeat(dict(conf)))
+            for gitpath, (part, entries, spans) in zip(gitpaths, results):
+                print("Git path: %s" % gitpath)
+                tracing.extend(spans)
+                data.cache.update(entries)
+                with tracing.span("merge", gitpath=gitpath):
+                    data.merge(part)
+    except (OSError, subprocess.CalledProcessError) as e:
+        # nothing is written, the cache of the last run stays as it was
+        print("FATAL: %s" % e)
+        sys.exit(1)
 
-        os.chdir(prevdir)
+    # the commits of all repositories for "gitstats serve", which reads
+    # them from the cached history aggregates of each repository
+    if isselected("commit_series"):
+        serve_data = data.cache["serve"]
+        serve_data["history"] = data.history_keys
+        serve_data["tags"] = data.tags
+        for key in ("commits", "files_by_stamp"):
+            # copies kept by older versions
+            if key in serve_data:
+                del serve_data[key]
 
     print("Refining data...")
     data.saveCache(cachefile)
     data.refine()
     
-    with open(os.path.join(outputpath, 'report.json'), 'w') as f:
-        f.write(data.dumpJson())
-    
-    time_end = time.time()
+    # per-commit series as columnar files next to report.json
+    series = None
+    if len(conf["series_format"]) > 0:
+        series = data.dumpSeries(outputpath, conf["series_format"])
+
+    reportfile = os.path.join(outputpath, 'report.json')
+    if conf["json_gzip"]:
+        f = gzip.open(reportfile + '.gz', 'wb')
+    else:
+        f = open(reportfile, 'wb')
+    with f:
+        data.dumpJson(f, series, conf["json_indent"])
+
+    closeexecutor()
+
+    # spans of all phases and git commands as a Chrome trace
+    if conf["trace"]:
+        tracing.writetrace(os.path.join(outputpath, "trace.json"))
+
+    timings = tracing.gettimings()
+    external = sum(c["wall"] for c in timings["commands"].values())
+    print("Execution time %.5f secs, %.5f secs in external commands" %
+          (timings["wall"], external))
 
@@ -0,0 +1,123 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from common.GitDataCollector import GitDataCollector
+from common.constans import conf
+
+# a branchy history with author dates older than their parents'
+SHAPE = {
+    "commits": 300,
+    "authors": 8,
+    "files": 40,
+    "tags": 0,
+    "branches": 3,
+    "merges": 0.3,
+    "skew": 0.2,
+}
+
+
+class MergeTest(unittest.TestCase):
+    """
+    Parts of the history merged with GitDataCollector.mergeHistory() give
+    the report of a single walk, however the history is split.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.conf = dict(conf)
+        cls.tmpdir = tempfile.mkdtemp(prefix="gitstats-test-")
+        cls.gitpath = os.path.join(cls.tmpdir, "repo")
+        shape = dict(benchmark.shape)
+        benchmark.shape.update(SHAPE)
+        try:
+            benchmark.generaterepository(cls.gitpath)
+        finally:
+            benchmark.shape.update(shape)
+        # first-parent chain of the head, newest first
+        cls.mainline = subprocess.check_output(
+            ["git", "rev-list", "--first-parent", "HEAD"],
+            cwd=cls.gitpath,
+            text=True).split()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def tearDown(self):
+        conf.clear()
+        conf.update(self.conf)
+
+    def collect(self, head, exclude=None):
+        data = GitDataCollector()
+        data.dir = self.gitpath
+        return data.collectRange(head, exclude)
+
+    def getreport(self, data):
+        f = io.BytesIO()
+        data.refine()
+        data.dumpJson(f)
+        report = json.loads(f.getvalue())
+        del report["stamp_created"]
+        del report["timings"]
+        # sets, in no particular order
+        report["active_days"].sort()
+        for info in report["authors"].values():
+            info["active_days"].sort()
+        return report
+
+    def assertSameReport(self, data, expected):
+        report = self.getreport(data)
+        for section in expected:
+            self.assertEqual(report[section], expected[section], section)
+
+    def test_shards(self):
+        for linear in (1, 0):
+            with self.subTest(linear_linestats=linear):
+                conf["linear_linestats"] = linear
+                expected = self.getreport(self.collect(self.mainline[0]))
+                conf["history_shards"] = 3
+                self.assertSameReport(self.collect(self.mainline[0]),
+                                      expected)
+                conf["history_shards"] = 1
+
+    def test_incremental(self):
+        for linear in (1, 0):
+            with self.subTest(linear_linestats=linear):
+                conf["linear_linestats"] = linear
+                expected = self.getreport(self.collect(self.mainline[0]))
+                for boundary in self.mainline[40:200:80]:
+                    part = self.collect(boundary)
+                    part.mergeHistory(
+                        [self.collect(self.mainline[0], exclude=boundary)])
+                    self.assertSameReport(part, expected)
+
+    def test_associative(self):
+        conf["linear_linestats"] = 0
+        (head, b1, b2) = (self.mainline[0], self.mainline[60],
+                          self.mainline[150])
+        expected = self.getreport(self.collect(head))
+
+        # (a + b) + c
+        part = self.collect(b2)
+        part.mergeHistory([self.collect(b1, exclude=b2)])
+        part.mergeHistory([self.collect(head, exclude=b1)])
+        self.assertSameReport(part, expected)
+
+        # a + (b + c)
+        later = self.collect(b1, exclude=b2)
+        later.mergeHistory([self.collect(head, exclude=b1)])
+        part = self.collect(b2)
+        part.mergeHistory([later])
+        self.assertSameReport(part, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from common.ObjectDatabase import ObjectDatabase
+
+SHAPE = {
+    "commits": 200,
+    "authors": 4,
+    "files": 40,
+    "tags": 4,
+    "branches": 2,
+    "merges": 0.2,
+}
+
+
+class ObjectDatabaseTest(unittest.TestCase):
+    """
+    ObjectDatabase reads the objects of packs (with OFS deltas, from
+    `git gc --aggressive`) and loose objects as `git cat-file` does.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp(prefix="gitstats-test-")
+        cls.gitpath = os.path.join(cls.tmpdir, "repo")
+        shape = dict(benchmark.shape)
+        benchmark.shape.update(SHAPE)
+        try:
+            benchmark.generaterepository(cls.gitpath)
+        finally:
+            benchmark.shape.update(shape)
+        cls.git("gc", "-q", "--aggressive")
+        # a loose commit on top of the pack
+        cls.git("-c", "user.name=A", "-c", "user.email=a@example.com",
+                "commit", "-q", "--allow-empty", "-m", "loose")
+        cls.objects = ObjectDatabase(cls.gitpath)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.objects.close()
+        shutil.rmtree(cls.tmpdir)
+
+    @classmethod
+    def git(cls, *args):
+        return subprocess.check_output(("git", ) + args, cwd=cls.gitpath)
+
+    def getobjects(self):
+        # "<id> <type> <size>" of every object, packed or loose
+        return [
+            line.decode().split(" ") for line in self.git(
+                "cat-file", "--batch-check", "--batch-all-objects").split(
+                    b"\n") if len(line) > 0
+        ]
+
+    def test_deltas(self):
+        # the packs do hold deltas against earlier objects of the pack
+        deltas = 0
+        for name in os.listdir(
+                os.path.join(self.gitpath, ".git", "objects", "pack")):
+            if name.endswith(".idx"):
+                for line in self.git(
+                        "verify-pack", "-v",
+                        os.path.join(".git", "objects", "pack",
+                                     name)).split(b"\n"):
+                    if len(line.split()) == 7:
+                        deltas += 1
+        self.assertGreater(deltas, 0)
+
+    def test_read(self):
+        objects = self.getobjects()
+        contents = subprocess.run(
+            ["git", "cat-file", "--batch"],
+            input=b"".join(sha.encode() + b"\n" for (sha, _, _) in objects),
+            stdout=subprocess.PIPE,
+            cwd=self.gitpath,
+            check=True).stdout
+        pos = 0
+        for (sha, type, size) in objects:
+            pos = contents.index(b"\n", pos) + 1
+            data = contents[pos:pos + int(size)]
+            pos += int(size) + 1
+            self.assertEqual(self.objects.read(sha, cache=False),
+                             (type, data), sha)
+            self.assertEqual(self.objects.size(sha), int(size), sha)
+
+    def test_files(self):
+        self.assertEqual(self.objects.resolve("HEAD"),
+                         self.git("rev-parse", "HEAD").decode().strip())
+        for commit in self.git("rev-list", "--all").decode().split()[::10]:
+            files = []
+            for entry in self.git("ls-tree", "-r", "-z", commit).split(b"\0"):
+                if len(entry) == 0:
+                    continue
+                (info, path) = entry.split(b"\t", 1)
+                (mode, _, sha) = info.decode().split(" ")
+                files.append((mode, sha, path))
+            self.assertEqual(sorted(self.objects.iterfiles(commit)),
+                             sorted(files), commit)
+            self.assertEqual(self.objects.countfiles(commit), len(files),
+                             commit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.GitDataCollector import GitDataCollector
+from common.QueryServer import CommitIndex
+
+ENV = dict(os.environ,
+           GIT_AUTHOR_NAME="A",
+           GIT_AUTHOR_EMAIL="a@example.com",
+           GIT_COMMITTER_NAME="A",
+           GIT_COMMITTER_EMAIL="a@example.com")
+
+# path -> contents of every commit, None to remove the path; renames as
+# (old path, new path)
+COMMITS = [
+    {
+        "dir ক/ফাইল.py": "a\nb\n",
+        'we"ird.txt': "q\n",
+        "src/plain.txt": "x\ny\nz\n",
+    },
+    {
+        ("src/plain.txt", "lib/plain.txt"): None,
+        ("dir ক/ফাইল.py",
+         "dir ক/নতুন.py"): None,
+        "bin.dat": "\0\1",
+    },
+    {
+        'we"ird.txt': None,
+        "lib/plain.txt": "x\ny\nz\nw\n",
+    },
+]
+
+
+class PathTest(unittest.TestCase):
+    """
+    Paths reach the aggregates as they are in the tree: not quoted by git,
+    renames under their new path.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp(prefix="gitstats-test-")
+        cls.gitpath = os.path.join(cls.tmpdir, "repo")
+        subprocess.check_call(["git", "init", "-q", cls.gitpath])
+        for (i, changes) in enumerate(COMMITS):
+            for (path, contents) in changes.items():
+                if isinstance(path, tuple):
+                    os.makedirs(os.path.join(cls.gitpath,
+                                             os.path.dirname(path[1])),
+                                exist_ok=True)
+                    cls.git("mv", path[0], path[1])
+                elif contents is None:
+                    cls.git("rm", "-q", path)
+                else:
+                    fullpath = os.path.join(cls.gitpath, path)
+                    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+                    with open(fullpath, "w") as f:
+                        f.write(contents)
+                    cls.git("add", path)
+            cls.git("commit", "-q", "-m", "commit %d" % i)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    @classmethod
+    def git(cls, *args):
+        subprocess.check_call(("git", ) + args, cwd=cls.gitpath, env=ENV)
+
+    def getreport(self):
+        data = GitDataCollector()
+        data.dir = self.gitpath
+        data = data.collectRange("HEAD")
+        f = io.BytesIO()
+        data.refine()
+        data.dumpJson(f)
+        return json.loads(f.getvalue())
+
+    def test_churn(self):
+        churn = self.getreport()["churn"]
+        self.assertEqual(
+            set(entry["path"] for entry in churn["files"]),
+            set([
+                "dir ক/ফাইল.py",
+                "dir ক/নতুন.py",
+                'we"ird.txt', "src/plain.txt", "lib/plain.txt", "bin.dat"
+            ]))
+        self.assertIn("dir ক",
+                      [entry["path"] for entry in churn["directories"]])
+
+    def test_serve_extensions(self):
+        data = GitDataCollector()
+        data.loadCache(os.path.join(self.tmpdir, "gitstats.cache"))
+        data.collect(self.gitpath)
+        data.cache.close()
+        index = CommitIndex(data.commit_series, data.tags)
+        f = io.BytesIO()
+        data.refine()
+        data.dumpJson(f)
+        report = json.loads(f.getvalue())
+        self.assertEqual(set(index.getnames("extension")),
+                         set(report["extensions"]))
+
+
+if __name__ == "__main__":
+    unittest.main()